@@ -0,0 +1,350 @@
+#Performance benchmarks. Run with "python3 benchmark.py [name ...]"; with no names, every benchmark is run.
+import random, time, argparse
+from board import Board
+from los import LOSMatrix, np
+from pathfinding import find_path
+from utils import Point
+from const import REGION_PATH_MIN_DISTANCE
+
+def make_board(width, height, seed=1):
+	random.seed(seed)
+	board = Board(width, height)
+	board.procgen_level()
+	return board
+
+def time_per_call(func, args_list):
+	start = time.perf_counter()
+	for args in args_list:
+		func(*args)
+	return (time.perf_counter() - start) / len(args_list)
+
+def format_ms(secs):
+	return f"{secs*1000:.3f} ms"
+
+def bench_fov():
+	print("FOV: raycasting vs. shadowcasting (time per get_fov call)")
+	for width, height, num in [(50, 18, 200), (100, 50, 40), (200, 100, 10), (400, 200, 3)]:
+		board = make_board(width, height)
+		positions = [(board.random_passable(),) for _ in range(num)]
+		#Each raycast run starts from an empty LOS cache, as it does after generating a level
+		board.clear_los_cache()
+		t_ray = time_per_call(board.get_fov_raycast, positions)
+		t_shadow = time_per_call(board.compute_fov, positions)
+		print(f"  {width}x{height}: raycast {format_ms(t_ray)}, shadowcast {format_ms(t_shadow)} ({t_ray/t_shadow:.1f}x faster)")
+
+def random_walk(board, steps):
+	pos = board.random_passable()
+	walk = []
+	for _ in range(steps):
+		adj = board.get_adjacent_tiles(pos)
+		if adj:
+			pos = random.choice(adj)
+		walk.append((pos,))
+	return walk
+
+def bench_fov_cache():
+	print("FOV cache: random walk of 2000 steps (time per get_fov call)")
+	for width, height in [(50, 18), (100, 50)]:
+		board = make_board(width, height)
+		walk = random_walk(board, 2000)
+		t_uncached = time_per_call(board.compute_fov, walk)
+		t_cached = time_per_call(board.get_fov, walk)
+		hits = board.fov_cache_hits
+		total = hits + board.fov_cache_misses
+		print(f"  {width}x{height}: uncached {format_ms(t_uncached)}, cached {format_ms(t_cached)}, hit rate {hits/total:.1%}")
+
+def format_bytes(num):
+	for unit in ["B", "KB", "MB", "GB"]:
+		if num < 1024:
+			return f"{num:.1f} {unit}"
+		num /= 1024
+	return f"{num:.1f} TB"
+
+def random_pairs(board, num):
+	return [(board.random_passable(), board.random_passable()) for _ in range(num)]
+
+def bench_los_matrix():
+	print("LOS matrix: build time, memory, and query time vs. has_line_of_sight")
+	for width, height in [(30, 12), (50, 18), (70, 30)]:
+		board = make_board(width, height)
+		matrix = LOSMatrix(width, height, board.wall_bytes())
+		start = time.perf_counter()
+		matrix.build()
+		t_build = time.perf_counter() - start
+		pairs = random_pairs(board, 5000)
+		board.clear_los_cache()
+		t_walk = time_per_call(board.has_line_of_sight, pairs)
+		t_bit = time_per_call(matrix.test, pairs)
+		print(f"  {width}x{height}: {len(matrix.cells)} open cells, {format_bytes(matrix.nbytes())}, built in {t_build:.2f} s; query {t_walk*1e6:.2f} us -> {t_bit*1e6:.2f} us")
+	print("  Estimated memory at 50% open area:")
+	for width, height in [(100, 50), (200, 100), (1000, 1000)]:
+		num_open = width * height // 2
+		print(f"    {width}x{height}: {format_bytes(LOSMatrix.estimate_bytes(num_open))}")
+
+def bench_los_cache():
+	print("LOS cache: 12 monsters checking line of sight to a player on a random walk")
+	for width, height in [(50, 18), (100, 50)]:
+		board = make_board(width, height)
+		walk = random_walk(board, 2000)
+		monsters = [board.random_passable() for _ in range(12)]
+		queries = [(mon, pos) for (pos,) in walk for mon in monsters]
+		uncached = lambda p1, p2: board._check_simple_los(p1, p2) or board._check_simple_los(p2, p1)
+		t_uncached = time_per_call(uncached, queries)
+		t_cached = time_per_call(board.has_line_of_sight, queries)
+		stats = board.los_cache.stats()
+		print(f"  {width}x{height}: uncached {t_uncached*1e6:.2f} us, cached {t_cached*1e6:.2f} us, hit rate {stats['hit_rate']:.1%}, {stats['entries']} entries ({format_bytes(board.los_cache.nbytes())})")
+
+def bench_los_many():
+	print("Batch LOS: Board.los_many vs. looping over has_line_of_sight (time per batch)")
+	if np is None:
+		print("  (NumPy is not installed, so los_many falls back to a loop)")
+	for width, height, batch in [(50, 18, 60), (100, 50, 200), (200, 100, 1000)]:
+		board = make_board(width, height)
+		queries = [(board.random_passable(), [board.random_passable() for _ in range(batch)]) for _ in range(20)]
+		def loop(origin, positions):
+			board.clear_los_cache()
+			return [board.has_line_of_sight(origin, pos) for pos in positions]
+		t_loop = time_per_call(loop, queries)
+		t_many = time_per_call(board.los_many, queries)
+		print(f"  {width}x{height}, {batch} positions: loop {format_ms(t_loop)}, los_many {format_ms(t_many)} (speedup {t_loop/t_many:.1f}x)")
+
+class _ObjectTile:
+	#The old storage layout (one object per cell), used as a baseline
+	def __init__(self):
+		self.wall = False
+		self.revealed = False
+		self.stair = 0
+		self.items = []
+
+def bench_board_storage():
+	print("Board storage: flat arrays vs. a grid of tile objects")
+	for width, height in [(50, 18), (200, 100), (1000, 1000)]:
+		start = time.perf_counter()
+		grid = [[_ObjectTile() for _ in range(width)] for _ in range(height)]
+		t_old_alloc = time.perf_counter() - start
+		board = Board(width, height)
+		start = time.perf_counter()
+		board.clear_grid()
+		t_alloc = time.perf_counter() - start
+		
+		def old_passable(pos):
+			if not board.in_bounds(pos):
+				return False
+			return not grid[pos.y][pos.x].wall
+		positions = [(board.random_pos(),) for _ in range(20000)]
+		t_old = time_per_call(old_passable, positions)
+		t_new = time_per_call(board.passable, positions)
+		print(f"  {width}x{height}: allocation {format_ms(t_old_alloc)} -> {format_ms(t_alloc)}, passable {t_old*1e9:.0f} ns -> {t_new*1e9:.0f} ns")
+
+def bench_procgen():
+	import procgen
+	print("Level generation: cellular automata passes (NumPy vs. pure Python) and the whole of procgen_level")
+	if np is None:
+		print("  (NumPy is not installed, so only the pure Python passes are timed)")
+	for width, height in [(50, 18), (200, 100), (400, 200)]:
+		random.seed(1)
+		grid = [[random.randint(0, 1) for _ in range(width - 2)] for _ in range(height - 2)]
+		def python_passes():
+			for _ in range(6):
+				procgen.cellular_automata_pass([row[:] for row in grid])
+		t_python = time_per_call(python_passes, [()] * 3)
+		line = f"  {width}x{height}: 6 passes {format_ms(t_python)} in Python"
+		if np is not None:
+			t_numpy = time_per_call(lambda: procgen.cellular_automata([row[:] for row in grid], 6), [()] * 3)
+			line += f", {format_ms(t_numpy)} with NumPy"
+		start = time.perf_counter()
+		make_board(width, height)
+		print(f"{line}; procgen_level {time.perf_counter() - start:.2f} s")
+
+def make_game(width, height, seed=1):
+	from game_inst import Game
+	from entity import Entity
+	from spell import Spell
+	random.seed(seed)
+	g = Game()
+	g._board = Board(width, height)
+	#Benchmarks shouldn't write save files
+	g.autosave = lambda: None
+	Entity.g = g
+	Spell.g = g
+	g.load_json_data()
+	g.init_player()
+	g.generate_level()
+	player = g.get_player()
+	player.HP = player.MAX_HP = 10**9
+	return g
+	
+def wait_for_pregen(g):
+	#Don't let the next level's generation in the background compete with whatever is being timed
+	if g.pregen:
+		g.pregen.result()
+
+def play_turns(g, num):
+	player = g.get_player()
+	dirs = [(0, 1), (0, -1), (1, 0), (-1, 0)]
+	start = time.perf_counter()
+	for _ in range(num):
+		dx, dy = random.choice(dirs)
+		if not player.move_dir(dx, dy):
+			player.use_energy(100)
+		g.do_turn()
+		g.reveal_seen_tiles()
+	return (time.perf_counter() - start) / num
+
+def bench_turns():
+	print("Turn latency by board size (random walk, time per turn; level generation not included)")
+	for width, height in [(50, 18), (100, 50), (200, 100), (400, 200), (1000, 1000)]:
+		start = time.perf_counter()
+		g = make_game(width, height)
+		t_gen = time.perf_counter() - start
+		wait_for_pregen(g)
+		t_turn = play_turns(g, 300)
+		print(f"  {width}x{height}: {format_ms(t_turn)} per turn ({len(g.monsters)} monsters, generated in {t_gen:.2f} s)")
+
+def bench_pathfinding():
+	print("Pathfinding: A* between random pairs of open cells (time per get_path call)")
+	for width, height in [(50, 18), (100, 50), (200, 100), (400, 200)]:
+		board = make_board(width, height)
+		pairs = random_pairs(board, 200)
+		t_path = time_per_call(board.get_path, pairs)
+		#Paths to a wall: without the component labels, the search has to exhaust the whole region first
+		walls = [(board.random_passable(), Point(0, 0)) for _ in range(20)]
+		t_flood = time_per_call(lambda start, end: find_path(board, start, end, board.passable, lambda p: 1), walls)
+		t_reject = time_per_call(board.get_path, walls)
+		t_budget = time_per_call(lambda start, end: board.get_path(start, end, max_expansions=1000), pairs)
+		print(f"  {width}x{height}: {format_ms(t_path)} ({format_ms(t_budget)} with a budget of 1000 cells); unreachable goal {format_ms(t_flood)} -> {format_ms(t_reject)}")
+
+def bench_path_costs():
+	print("Monster path costs: cost_func callback vs. the board's move_costs layer (time per get_path call)")
+	for width, height in [(50, 18), (100, 50), (200, 100)]:
+		g = make_game(width, height)
+		wait_for_pregen(g)
+		board = g.get_board()
+		monsters = [m for m in g.monsters if m.is_alive()]
+		queries = [(random.choice(monsters), board.random_passable()) for _ in range(200)]
+		t_func = time_per_call(lambda m, goal: board.get_path(m.pos, goal, m.path_cost), queries)
+		t_costs = time_per_call(lambda m, goal: board.get_path(m.pos, goal, costs=board.move_costs), queries)
+		print(f"  {width}x{height}: cost_func {format_ms(t_func)}, move_costs {format_ms(t_costs)} (speedup {t_func/t_costs:.1f}x)")
+
+def bench_path_cache():
+	print("Shared path cache: a pack of 6 monsters in one region heading for the same goal (time per pack)")
+	for width, height in [(50, 18), (100, 50), (200, 100)]:
+		board = make_board(width, height)
+		packs = []
+		while len(packs) < 50:
+			center = board.random_passable()
+			members = [p for p in board.points_in_radius(center, 3) if board.passable(p)][:6]
+			goal = board.random_passable()
+			if len(members) == 6 and board.is_reachable(center, goal):
+				packs.append((members, goal))
+		def separate(members, goal):
+			for pos in members:
+				board.get_path(pos, goal, costs=board.move_costs)
+		def shared(members, goal):
+			board.bump_occupancy_version()
+			for pos in members:
+				board.shared_path(pos, goal)
+		t_separate = time_per_call(separate, packs)
+		t_shared = time_per_call(shared, packs)
+		hits = board.path_cache_hits
+		total = hits + board.path_cache_misses
+		print(f"  {width}x{height}: separate searches {format_ms(t_separate)}, shared {format_ms(t_shared)} (hit rate {hits/total:.0%})")
+
+def bench_jps():
+	print("Jump point search vs. A* on uniform-cost paths (cells or jump points expanded, and time per search)")
+	for width, height in [(50, 18), (100, 50), (200, 100), (400, 200)]:
+		board = make_board(width, height)
+		pairs = random_pairs(board, 200)
+		results = {}
+		for name, jps in [("A*", False), ("JPS", True)]:
+			expanded = 0
+			start = time.perf_counter()
+			for p1, p2 in pairs:
+				board.get_path(p1, p2, jps=jps)
+				expanded += board.last_path_expansions
+			results[name] = (expanded / len(pairs), (time.perf_counter() - start) / len(pairs))
+		(n_astar, t_astar), (n_jps, t_jps) = results["A*"], results["JPS"]
+		print(f"  {width}x{height}: A* {n_astar:.0f} expanded in {format_ms(t_astar)}, JPS {n_jps:.0f} expanded in {format_ms(t_jps)} ({n_astar/n_jps:.1f}x fewer)")
+
+def bench_regions():
+	print("Hierarchical pathfinding: long paths through the region graph vs. plain A* (time per search)")
+	from pathfinding import search_path
+	for width, height in [(400, 200), (800, 400)]:
+		start = time.perf_counter()
+		board = make_board(width, height)
+		t_gen = time.perf_counter() - start
+		graph = board.region_graph
+		pairs = []
+		while len(pairs) < 100:
+			pair = random_pairs(board, 1)[0]
+			if pair[0].distance(pair[1]) >= REGION_PATH_MIN_DISTANCE:
+				pairs.append(pair)
+		t_astar = time_per_call(lambda p1, p2: search_path(board, p1, p2, None, None, None, board.move_costs), pairs)
+		t_cold = time_per_call(lambda p1, p2: graph.find_path(p1, p2, board.move_costs), pairs)
+		t_warm = time_per_call(lambda p1, p2: graph.find_path(p1, p2, board.move_costs), pairs)
+		print(f"  {width}x{height} (generated in {t_gen:.1f} s): A* {format_ms(t_astar)}, region graph {format_ms(t_cold)} while building clusters, {format_ms(t_warm)} after (speedup {t_astar/t_warm:.1f}x)")
+
+def bench_approach():
+	print("Chasing: 12 monsters finding their next step toward a player on a random walk (time per turn)")
+	from pathfinding import ApproachMap
+	for width, height in [(50, 18), (100, 50), (200, 100)]:
+		board = make_board(width, height)
+		walk = random_walk(board, 200)
+		monsters = [board.random_passable() for _ in range(12)]
+		def astar(goal):
+			for mon in monsters:
+				board.get_path(mon, goal)
+		def approach(goal):
+			approach = ApproachMap(board, goal)
+			for mon in monsters:
+				here = approach.distance(mon)
+				[p for p in board.get_adjacent_tiles(mon) if approach.distance(p) == here - 1]
+		t_astar = time_per_call(astar, walk)
+		t_approach = time_per_call(approach, walk)
+		print(f"  {width}x{height}: A* per monster {format_ms(t_astar)}, shared approach map {format_ms(t_approach)} (speedup {t_astar/t_approach:.1f}x)")
+
+def bench_spatial():
+	print("Entity queries: spatial index vs. scanning every cell in the radius (time per monsters_in_radius call)")
+	for width, height in [(50, 18), (200, 100), (400, 200)]:
+		g = make_game(width, height)
+		wait_for_pregen(g)
+		board = g.get_board()
+		def scan(pos, radius):
+			return [mon for p in board.points_in_radius(pos, radius) if (mon := g.monster_at(p))]
+		queries = [(board.random_passable(), radius) for radius in (3, 6, 10, 16) for _ in range(50)]
+		t_scan = time_per_call(scan, queries)
+		t_index = time_per_call(lambda pos, radius: list(g.monsters_in_radius(pos, radius)), queries)
+		t_nearest = time_per_call(lambda pos, radius: board.nearest_entities(pos, 5), queries)
+		print(f"  {width}x{height} ({len(g.monsters)} monsters): scan {format_ms(t_scan)}, index {format_ms(t_index)} (speedup {t_scan/t_index:.1f}x); nearest 5 in {format_ms(t_nearest)}")
+
+BENCHMARKS = {
+	"fov": bench_fov,
+	"fov_cache": bench_fov_cache,
+	"los_matrix": bench_los_matrix,
+	"los_cache": bench_los_cache,
+	"los_many": bench_los_many,
+	"board_storage": bench_board_storage,
+	"procgen": bench_procgen,
+	"spatial": bench_spatial,
+	"pathfinding": bench_pathfinding,
+	"approach": bench_approach,
+	"path_costs": bench_path_costs,
+	"regions": bench_regions,
+	"jps": bench_jps,
+	"path_cache": bench_path_cache,
+	"turns": bench_turns
+}
+
+def main():
+	parser = argparse.ArgumentParser(description="Run performance benchmarks")
+	parser.add_argument("names", nargs="*", metavar="name", help=f"benchmarks to run (choices: {', '.join(BENCHMARKS)})")
+	args = parser.parse_args()
+	names = args.names or list(BENCHMARKS)
+	for name in names:
+		if name not in BENCHMARKS:
+			parser.error(f"unknown benchmark {name!r}")
+	for name in names:
+		BENCHMARKS[name]()
+
+if __name__ == "__main__":
+	main()
@@ -1,15 +1,57 @@
 from utils import *
 import random
-from collections import defaultdict
-from pathfinding import find_path
+from collections import defaultdict, OrderedDict
+from array import array
+from const import *
+from pathfinding import search_path, search_path_jps, ApproachMap
+from fov import shadowcast, FOVMask
+from los import LOSMatrix, LOSCache, clear_lines_numpy, np
+from spatial import SpatialIndex
+from regions import RegionGraph
+from threading import Thread
 
 class Tile:
+	#A lightweight view of one cell; the data itself lives in the board's flat arrays
+	__slots__ = ("board", "index")
 	
-	def __init__(self):
-		self.wall = False
-		self.revealed = False
-		self.stair = 0
-		self.items = []
+	def __init__(self, board, index):
+		self.board = board
+		self.index = index
+		
+	@property
+	def wall(self):
+		return self.board.walls[self.index] == 1
+		
+	@wall.setter
+	def wall(self, wall):
+		y, x = divmod(self.index, self.board.width)
+		self.board.set_wall(x, y, wall)
+		
+	@property
+	def revealed(self):
+		y, x = divmod(self.index, self.board.width)
+		return self.board.revealed.has(x, y)
+		
+	@revealed.setter
+	def revealed(self, revealed):
+		y, x = divmod(self.index, self.board.width)
+		if revealed:
+			self.board.revealed.add(x, y)
+		else:
+			self.board.revealed.discard(x, y)
+		
+	@property
+	def stair(self):
+		return self.board.stairs[self.index]
+		
+	@stair.setter
+	def stair(self, stair):
+		self.board.stairs[self.index] = stair
+		
+	@property
+	def items(self):
+		#Stored in the map, so that items appended to the list stay on the tile
+		return self.board.item_map.setdefault(self.index, [])
 		
 	def is_passable(self):
 		return not self.wall
@@ -32,17 +74,84 @@ fields = {
 	"dense_fog": DenseFog
 }
 
+class BoardPregen:
+	#Generates the level for depth in a background thread, drawing only from rand (its own random.Random), so the game's rolls
+	#aren't disturbed. The board is ready to swap in by the time the player finds the stairs; result() waits for it if it isn't.
+	
+	def __init__(self, width, height, depth, rand, precompute_los=PRECOMPUTE_LOS):
+		self.width = width
+		self.height = height
+		self.depth = depth
+		self.rand = rand
+		self.precompute_los = precompute_los
+		self.board = None
+		self.thread = Thread(target=self.generate, daemon=True)
+		self.thread.start()
+		
+	def generate(self):
+		board = Board(self.width, self.height)
+		board.precompute_los = self.precompute_los
+		board.procgen_level(self.rand)
+		self.board = board
+		
+	def result(self):
+		self.thread.join()
+		return self.board
+		
 class Board:
 		
 	def __init__(self, width, height):
 		self.width = width
 		self.height = height
 		self.clear_grid()
-		self.mon_collision_cache = [[None for i in range(width)] for j in range(height)]	
-		self.los_cache = [[{} for i in range(width)] for j in range(height)]	
+		self.mon_collision_cache = {}
+		self.entity_index = SpatialIndex(width, height, SPATIAL_SHIFT)
+		self.los_cache = LOSCache(width, height, LOS_CACHE_MAX_BYTES)
 		self.field_map = {}
 		self.recalc_sight = False
 		self.player = None
+		#Walls only change when a level is generated, so FOV only needs to be recalculated when the fields change
+		self.field_version = 0
+		self.fov_cache = OrderedDict()
+		self.fov_cache_hits = 0
+		self.fov_cache_misses = 0
+		self.precompute_los = PRECOMPUTE_LOS
+		self.los_matrix = None
+		self.wall_array = None
+		self.approach_maps = OrderedDict()
+		self.last_path_expansions = 0
+		self.region_graph = None
+		#Recent monster paths, keyed by (start region, goal, occupancy version); see shared_path
+		self.occupancy_version = 0
+		self.path_cache = OrderedDict()
+		self.path_cache_hits = 0
+		self.path_cache_misses = 0
+		#Random source for breaking ties in path searches; the game sets it to its AI stream, otherwise the random module is used
+		self.path_rng = None
+		#What procgen reported about the level (see levelstats.py); None if it wasn't generated here
+		self.initial_zones = None
+		self.corridor_lengths = None
+		
+	def __getstate__(self):
+		#The caches are all rebuilt on demand, so leave them out of saves; they'd be most of the pickle otherwise
+		d = self.__dict__.copy()
+		for field in ["fov_cache", "approach_maps", "path_cache", "los_cache", "wall_array"]:
+			del d[field]
+		return d
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self.fov_cache = OrderedDict()
+		self.approach_maps = OrderedDict()
+		self.path_cache = OrderedDict()
+		self.los_cache = LOSCache(self.width, self.height, LOS_CACHE_MAX_BYTES)
+		self.wall_array = None
+		#The worker thread doesn't survive saving and loading, so restart it if it hadn't finished
+		if self.los_matrix and not self.los_matrix.ready:
+			self.start_los_matrix()
+		
+	def bump_field_version(self):
+		self.field_version += 1
 		
 	def field_at(self, pos):
 		return self.field_map.get(pos)
@@ -51,6 +160,7 @@ class Board:
 		player = self.player
 		if pos in self.field_map:
 			del self.field_map[pos]
+			self.bump_field_version()
 			if player.sees_pos(pos):
 				self.recalc_sight = True
 		
@@ -85,20 +195,34 @@ class Board:
 			
 	def put_field(self, pos, field):
 		self.field_map[pos] = field	
+		self.bump_field_version()
 		
 	def place_item_at(self, pos, item):
-		self.get_tile(pos).items.append(item)
+		index = pos.y * self.width + pos.x
+		self.item_map.setdefault(index, []).append(item)
+		
+	def items_at(self, pos):
+		return self.item_map.get(pos.y * self.width + pos.x, [])
 	
 	def clear_grid(self):
 		width = self.width
 		height = self.height
-		self.grid = [[Tile() for _ in range(width)] for _ in range(height)]	
-		
-	def random_passable(self):
+		self.walls = bytearray(width * height)
+		self.stairs = bytearray(width * height)
+		#Cost for monsters to path through each cell: 0 for walls, OCCUPIED_PATH_COST where a monster is standing, otherwise 1.
+		#Kept up to date along with the walls and the collision cache, so path searches can read it directly
+		self.move_costs = bytearray(b"\x01") * (width * height)
+		#Connected region of open cells that each cell belongs to, numbered from 1; 0 for walls
+		self.components = array("I", bytes(4 * width * height))
+		self.component_sizes = [0]
+		self.revealed = FOVMask(width, height)
+		self.item_map = {}
+		
+	def random_passable(self, component=None, rand=random):
 		MAX_TRIES = 6 * self.width * self.height
 		for _ in range(MAX_TRIES):
-			pos = self.random_pos()
-			if self.passable(pos):
+			pos = self.random_pos(rand)
+			if self.passable(pos) and (component is None or self.component_at(pos) == component):
 				return pos
 		raise RuntimeError("Could not find a valid passable position")		
 		
@@ -112,25 +236,66 @@ class Board:
 			self.set_wall(0, y, True)
 			self.set_wall(width-1, y, True) 		
 		
-	def set_los_cache(self, pos1, pos2, has_los):
-		cache1 = self.los_cache[pos1.y][pos1.x]
-		cache1[pos2.copy()] = has_los
+	def clear_los_cache(self):
+		self.los_cache.clear()
 		
-	def get_los_cache(self, pos1, pos2):
-		cache1 = self.los_cache[pos1.y][pos1.x]
-		if (val := cache1.get(pos2)):
-			return val
+	def wall_bytes(self):
+		return self.walls.copy()
 		
-		return None
+	def start_los_matrix(self):
+		#Builds the matrix in a background thread; until it's ready, line of sight is checked the normal way
+		self.stop_los_matrix()
+		self.los_matrix = LOSMatrix(self.width, self.height, self.wall_bytes())
+		self.los_matrix.start()
 		
-	def clear_los_cache(self):
-		width = self.width
-		height = self.height
-		self.los_cache = [[{} for i in range(width)] for j in range(height)]	
+	def stop_los_matrix(self):
+		if self.los_matrix:
+			self.los_matrix.cancelled = True
+			self.los_matrix = None
 		
 	def has_line_of_sight(self, pos1, pos2):
-		return self._check_simple_los(pos1, pos2) or self._check_simple_los(pos2, pos1)
+		matrix = self.los_matrix
+		if matrix and matrix.ready:
+			return matrix.test(pos1, pos2)
+		if pos1 == pos2:
+			return True
+		if not (self.in_bounds(pos1) and self.in_bounds(pos2)):
+			return False
+		cache = self.los_cache
+		key = cache.key(pos1, pos2)
+		if (val := cache.get(key)) is None:
+			val = self._check_simple_los(pos1, pos2) or self._check_simple_los(pos2, pos1)
+			cache.put(key, val)
+		return val
 	
+	def get_wall_array(self):
+		if self.wall_array is None:
+			walls = np.frombuffer(self.walls, dtype=np.uint8)
+			self.wall_array = walls.reshape(self.height, self.width).astype(bool)
+		return self.wall_array
+		
+	def los_many(self, origin, positions):
+		#Checks line of sight from origin to each of the positions. With NumPy, all of the lines are traced at once
+		#and a bool array is returned; otherwise, this returns a list of bools.
+		matrix = self.los_matrix
+		if np is None or len(positions) < LOS_MANY_MIN_BATCH or (matrix and matrix.ready):
+			return [self.has_line_of_sight(origin, pos) for pos in positions]
+			
+		xs = np.fromiter((pos.x for pos in positions), dtype=np.int64, count=len(positions))
+		ys = np.fromiter((pos.y for pos in positions), dtype=np.int64, count=len(positions))
+		result = (xs == origin.x) & (ys == origin.y)
+		if not self.in_bounds(origin):
+			return result
+		in_bounds = (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height) & ~result
+		xs = xs[in_bounds]
+		ys = ys[in_bounds]
+		ox = np.full_like(xs, origin.x)
+		oy = np.full_like(ys, origin.y)
+		walls = self.get_wall_array()
+		forward = clear_lines_numpy(walls, ox, oy, xs, ys)
+		result[in_bounds] = forward | clear_lines_numpy(walls, xs, ys, ox, oy)
+		return result
+		
 	def has_clear_path(self, pos1, pos2):
 		return self._check_simple_clear_path(pos1, pos2) or self._check_simple_clear_path(pos2, pos1)
 		
@@ -138,8 +303,6 @@ class Board:
 		if pos1 == pos2:
 			return True
 		
-		if (val := self.get_los_cache(pos1, pos2)):
-			return val
 		old_pos = None
 		
 		num_field = 0
@@ -152,18 +315,14 @@ class Board:
 					blocked += not self.passable(Point(pos.x + delta.x, pos.y))
 					blocked += not self.passable(Point(pos.x, pos.y + delta.y))
 					if blocked >= 2:
-						self.set_los_cache(pos1, pos, False)
 						return False
 			passable = self.passable(pos)
 				
 			if not passable:	
-				self.set_los_cache(pos1, pos2, False)
 				return False
 			
-			self.set_los_cache(pos1, pos, True)
 			old_pos = pos
 			
-		self.set_los_cache(pos1, pos2, True)
 		return True
 		
 	def field_blocks_view(self, pos1, pos2):
@@ -213,42 +372,76 @@ class Board:
 		return True
 		
 	def set_collision_cache(self, pos, val):
-		self.mon_collision_cache[pos.y][pos.x] = val
+		index = pos.y * self.width + pos.x
+		if val is None:
+			self.mon_collision_cache.pop(index, None)
+			self.entity_index.remove(pos.x, pos.y)
+			self.move_costs[index] = 0 if self.walls[index] else 1
+		else:
+			self.mon_collision_cache[index] = val
+			self.entity_index.add(pos.x, pos.y, val)
+			self.move_costs[index] = OCCUPIED_PATH_COST if val.is_monster() else 1
 		
 	def get_collision_cache(self, pos):
-		return self.mon_collision_cache[pos.y][pos.x]
+		return self.mon_collision_cache.get(pos.y * self.width + pos.x)
 		
 	def erase_collision_cache(self, pos):
 		self.set_collision_cache(pos, None)
 			
 	def clear_collision_cache(self):
-		width = self.width
-		height = self.height
-		self.mon_collision_cache = [[None for i in range(width)] for j in range(height)]
+		for index in self.mon_collision_cache:
+			self.move_costs[index] = 0 if self.walls[index] else 1
+		self.mon_collision_cache.clear()
+		self.entity_index.clear()
+		
+	def entities_in_radius(self, center, radius):
+		return self.entity_index.in_radius(center.x, center.y, radius)
+		
+	def entities_in_rect(self, x1, y1, x2, y2):
+		return self.entity_index.in_rect(x1, y1, x2, y2)
+		
+	def nearest_entities(self, pos, k, pred=None):
+		return self.entity_index.nearest(pos.x, pos.y, k, pred)
 	
-	def random_pos(self):
-		x = rng(1, self.width - 1)
-		y = rng(1, self.height - 1)
+	def random_pos(self, rand=random):
+		x = rand.randint(1, self.width - 1)
+		y = rand.randint(1, self.height - 1)
 		return Point(x, y)
 			
 	def set_wall(self, x, y, wall):
-		self.grid[y][x].wall = wall
+		index = y * self.width + x
+		self.walls[index] = wall
+		self.move_costs[index] = 0 if wall else 1
+		if self.region_graph:
+			self.region_graph.invalidate(x, y)
+	
+	def set_wall_row(self, x, y, row):
+		#Sets the walls from (x, y) rightward from a sequence of 0s and 1s
+		start = y * self.width + x
+		end = start + len(row)
+		self.walls[start:end] = bytes(row)
+		self.move_costs[start:end] = bytes(1 - wall for wall in row)
+		if self.region_graph:
+			for i in range(len(row)):
+				self.region_graph.invalidate(x + i, y)
 	
 	def get_tile(self, pos):
-		return self.grid[pos.y][pos.x]
+		return Tile(self, pos.y * self.width + pos.x)
 		
 	def passable(self, pos):
-		if not self.in_bounds(pos):
-			return False
-		return not self.get_tile(pos).wall
+		x = pos.x
+		y = pos.y
+		width = self.width
+		if 0 <= x < width and 0 <= y < self.height:
+			return not self.walls[y * width + x]
+		return False
 		
 	def blocks_sight(self, pos):
 		#This is just a placeholder to be extended when other things block sight
 		return not self.passable(pos)
 		
 	def reveal_tile_at(self, pos):
-		tile = self.get_tile(pos)
-		tile.revealed = True
+		self.revealed.add(pos.x, pos.y)
 		
 	def in_bounds(self, pos):
 		if pos.x < 0 or pos.x >= self.width:
@@ -319,13 +512,66 @@ class Board:
 			
 		return points_in_line(pos1, pos2)
 				
-	def procgen_level(self):
+	def procgen_level(self, rand=random):
 		from procgen import procgen
+		self.region_graph = None
 		self.clear_grid()
 		self.init_border()
-		procgen(self)
+		self.initial_zones, self.corridor_lengths = procgen(self, rand)
+		self.level_changed()
+		
+	def load_level(self, walls, initial_zones=None, corridor_lengths=None):
+		#Sets up a level from a saved layout (one byte per cell, 1 for walls, as in self.walls) instead of generating one
+		self.region_graph = None
+		self.clear_grid()
+		self.set_wall_row(0, 0, walls)
+		self.initial_zones = initial_zones
+		self.corridor_lengths = corridor_lengths
+		self.level_changed()
+		
+	def level_changed(self):
+		#Rebuilds everything derived from the walls after a new level is laid out
+		self.label_components()
+		if self.width * self.height >= REGION_GRAPH_MIN_CELLS:
+			self.region_graph = RegionGraph(self, REGION_SIZE)
+		self.bump_field_version()
+		self.clear_los_cache()
+		self.wall_array = None
+		self.approach_maps.clear()
+		self.bump_occupancy_version()
+		if self.precompute_los and self.width * self.height <= LOS_MATRIX_MAX_CELLS:
+			self.start_los_matrix()
+		else:
+			self.stop_los_matrix()
 	
+	def fov_cache_capacity(self):
+		size = min(2 * FOV_RADIUS + 1, self.width, self.height)
+		per_entry = size * size
+		return max(1, min(FOV_CACHE_SIZE, FOV_CACHE_MAX_BYTES // per_entry))
+		
+	def compute_fov(self, pos):
+		fov = FOVMask(self.width, self.height)
+		shadowcast(self, pos, fov.add)
+		return fov
+		
 	def get_fov(self, pos):
+		cache = self.fov_cache
+		key = (pos.x, pos.y, self.field_version)
+		if (fov := cache.get(key)) is not None:
+			self.fov_cache_hits += 1
+			cache.move_to_end(key)
+		else:
+			self.fov_cache_misses += 1
+			fov = self.compute_fov(pos)
+			cache[key] = fov
+			capacity = self.fov_cache_capacity()
+			while len(cache) > capacity:
+				cache.popitem(last=False)
+		#The caller gets its own copy, so that modifying it doesn't affect the cache
+		return fov.copy()
+		
+	def get_fov_raycast(self, pos):
+		#The old raycasting FOV, kept for comparison in benchmark.py
 		fov = set()
 		fov.add(pos)
 		
@@ -395,13 +641,111 @@ class Board:
 				
 		return fov
 		
-	def get_path(self, start, end, cost_func=None):
+	def label_components(self):
+		from procgen import zone_runs
+		width = self.width
+		walls = self.walls
+		labels = array("I", bytes(4 * width * self.height))
+		sizes = [0]
+		for label, runs in enumerate(zone_runs([walls[y * width:(y + 1) * width] for y in range(self.height)]), 1):
+			size = 0
+			for y, x1, x2 in runs:
+				labels[y * width + x1:y * width + x2] = array("I", [label]) * (x2 - x1)
+				size += x2 - x1
+			sizes.append(size)
+		self.components = labels
+		self.component_sizes = sizes
+		
+	def component_at(self, pos):
+		if not self.in_bounds(pos):
+			return 0
+		return self.components[pos.y * self.width + pos.x]
+		
+	def is_reachable(self, start, end):
+		#Whether there's any path between two open cells, ignoring entities
+		label = self.component_at(start)
+		return label != 0 and label == self.component_at(end)
+		
+	def get_path(self, start, end, cost_func=None, max_expansions=None, costs=None, jps=False):
+		#With max_expansions, the path may stop short of end; the number of cells the search expanded is left in last_path_expansions.
+		#costs (such as move_costs) is an array of per-cell costs to use instead of cost_func, which is much faster to search.
+		#jps selects jump point search, which only works when every step costs the same
+		self.last_path_expansions = 0
+		if self.component_at(start) and not self.is_reachable(start, end):
+			return []
+		if jps:
+			if cost_func is not None or costs is not None:
+				raise ValueError("jump point search doesn't support movement costs")
+			path, self.last_path_expansions = search_path_jps(self, start, end, max_expansions)
+			return path
+		if costs is not None:
+			#Long paths on big boards go through the region graph
+			if self.region_graph and start.distance(end) >= REGION_PATH_MIN_DISTANCE:
+				if (result := self.region_graph.find_path(start, end, costs, max_expansions)) is not None:
+					path, self.last_path_expansions = result
+					return path
+			path, self.last_path_expansions = search_path(self, start, end, None, None, max_expansions, costs)
+			return path
+		
 		def passable_func(p):
 			return p == start or self.passable(p)
 		
 		if cost_func is None:
 			cost_func = lambda p: 1
 			
-		return find_path(self, start, end, passable_func, cost_func)
+		path, self.last_path_expansions = search_path(self, start, end, passable_func, cost_func, max_expansions)
+		return path
+		
+	def bump_occupancy_version(self):
+		#Cached paths are only valid while the costs they were found with are; the game calls this once per turn
+		self.occupancy_version += 1
+		self.path_cache.clear()
+		
+	def shared_path(self, start, end, max_expansions=None):
+		#Like get_path with costs=move_costs, but monsters in the same region heading for the same goal share their searches.
+		#Each cache entry maps the cells of the paths found so far to (path, position on it); if start is on one of them,
+		#or next to one, we take the rest of that path from there.
+		width = self.width
+		key = (start.x // REGION_SIZE, start.y // REGION_SIZE, end.y * width + end.x, self.occupancy_version)
+		cache = self.path_cache
+		if (cells := cache.get(key)) is not None:
+			cache.move_to_end(key)
+			if (found := cells.get(start.y * width + start.x)) is not None:
+				self.path_cache_hits += 1
+				path, i = found
+				return [p.copy() for p in path[i:]]
+			options = [cells[n] for n in self.adjacent_indices(start) if n in cells]
+			if options:
+				self.path_cache_hits += 1
+				path, i = min(options, key=lambda found: len(found[0]) - found[1])
+				return [start.copy()] + [p.copy() for p in path[i:]]
+		self.path_cache_misses += 1
+		path = self.get_path(start, end, max_expansions=max_expansions, costs=self.move_costs)
+		#Partial paths don't lead to the goal, so they're no use to anyone else
+		if path and path[-1] == end:
+			if cells is None:
+				cells = cache[key] = {}
+				if len(cache) > PATH_CACHE_SIZE:
+					cache.popitem(last=False)
+			for i, p in enumerate(path):
+				cells.setdefault(p.y * width + p.x, (path, i))
+			return [p.copy() for p in path]
+		return path
+		
+	def adjacent_indices(self, pos):
+		index = pos.y * self.width + pos.x
+		return (index - 1, index + 1, index - self.width, index + self.width)
+		
+	def approach_map(self, goal):
+		#Walls only change when a level is generated, so a map stays valid for as long as its goal does
+		maps = self.approach_maps
+		key = goal.y * self.width + goal.x
+		if (approach := maps.get(key)) is not None:
+			maps.move_to_end(key)
+			return approach
+		approach = maps[key] = ApproachMap(self, goal)
+		if len(maps) > APPROACH_MAP_CACHE_SIZE:
+			maps.popitem(last=False)
+		return approach
 		
 		
\ No newline at end of file
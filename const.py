@@ -1,3 +1,46 @@
+BOARD_WIDTH = 50
+BOARD_HEIGHT = 18
+
+#The part of the board shown on screen; larger boards scroll to follow the player
+VIEW_WIDTH = 50
+VIEW_HEIGHT = 18
+
+#Boards are split into square chunks of 2**CHUNK_SHIFT cells for sparse per-cell data such as the player's FOV
+CHUNK_SHIFT = 5
+CHUNK_SIZE = 1 << CHUNK_SHIFT
+CHUNK_MASK = CHUNK_SIZE - 1
+
+FOV_RADIUS = 60
+
+#Number of distance maps toward shared targets (usually the player) kept per board
+APPROACH_MAP_CACHE_SIZE = 4
+
+#Monster path searches expand at most PATH_BUDGET_BASE + INT * PATH_BUDGET_PER_INT cells (half that when not chasing anything)
+PATH_BUDGET_BASE = 200
+PATH_BUDGET_PER_INT = 100
+
+#Boards with at least REGION_GRAPH_MIN_CELLS cells get a graph of REGION_SIZE x REGION_SIZE clusters for hierarchical pathfinding,
+#used for paths at least REGION_PATH_MIN_DISTANCE long
+REGION_GRAPH_MIN_CELLS = 10000
+REGION_SIZE = 16
+REGION_PATH_MIN_DISTANCE = 96
+
+#Number of recent monster paths kept for other monsters heading the same way
+PATH_CACHE_SIZE = 32
+
+#Path cost for a monster to move through a cell where another monster is standing
+OCCUPIED_PATH_COST = 3
+
+#When a monster's next step is blocked, it looks for a detour that rejoins its path at least this many steps ahead
+PATH_REPAIR_LOOKAHEAD = 3
+PATH_REPAIR_MAX_EXPANSIONS = 100
+
+#Live entities are bucketed into squares of 2**SPATIAL_SHIFT cells for radius and nearest-neighbor queries
+SPATIAL_SHIFT = 3
+
+#Check after every turn that the monster collision cache matches the entities' positions (slow; for debugging)
+DEBUG_CHECK_COLLISION = False
+
 WALL_SYMBOL = "#"
 PLAYER_SYMBOL = "@"
 STAIR_SYMBOL = ">"
@@ -21,6 +64,8 @@ COLOR_DODGER_BLUE2 = 27
 COLOR_DEEP_PINK2 = 167
 
 SAVED_GAME_PATH = "gamedata.pkl"
+#Level pack written by levelpack.py to take levels from instead of generating them, or None
+LEVEL_PACK_PATH = None
 
 MSG_TYPES = {
 	"neutral": 0,
@@ -38,4 +83,16 @@ class ItemUseResult:
 	USED = 1 #Item was used, but should not be consumed
 	CONSUMED = 2 #Item was used, and should be consumed
 
-ANIMATION_DELAY = 0.04
\ No newline at end of file
+ANIMATION_DELAY = 0.04
+
+FOV_CACHE_SIZE = 256
+FOV_CACHE_MAX_BYTES = 4 * 1024 * 1024
+LOS_CACHE_MAX_BYTES = 2 * 1024 * 1024
+
+#Board.los_many only uses NumPy for batches at least this large, since it has a fixed overhead per call
+LOS_MANY_MIN_BATCH = 64
+
+#If enabled, an all-pairs line of sight matrix is built in the background after each level is generated.
+#This is only done for boards up to LOS_MATRIX_MAX_CELLS in area, since memory use grows with the square of the area.
+PRECOMPUTE_LOS = False
+LOS_MATRIX_MAX_CELLS = 2500
\ No newline at end of file
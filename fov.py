@@ -0,0 +1,192 @@
+from collections import deque
+from utils import Point
+from const import CHUNK_SIZE, CHUNK_SHIFT, CHUNK_MASK, FOV_RADIUS
+
+CHUNK_AREA = CHUNK_SIZE * CHUNK_SIZE
+
+def _bytes_op(a, b, op):
+	result = op(int.from_bytes(a, "little"), int.from_bytes(b, "little"))
+	return bytearray(result.to_bytes(CHUNK_AREA, "little"))
+
+class FOVMask:
+	#A set of cells, stored as CHUNK_SIZE x CHUNK_SIZE chunks of one byte per cell. Chunks are only allocated once a cell
+	#in them is added, so the cost of a mask depends on the area it covers rather than on the size of the board.
+	
+	def __init__(self, width, height, chunks=None):
+		self.width = width
+		self.height = height
+		self.chunks_x = (width + CHUNK_SIZE - 1) // CHUNK_SIZE
+		if chunks is None:
+			chunks = {}
+		self.chunks = chunks
+		
+	def add(self, x, y):
+		key = (y >> CHUNK_SHIFT) * self.chunks_x + (x >> CHUNK_SHIFT)
+		chunk = self.chunks.get(key)
+		if chunk is None:
+			chunk = self.chunks[key] = bytearray(CHUNK_AREA)
+		chunk[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)] = 1
+		
+	def discard(self, x, y):
+		key = (y >> CHUNK_SHIFT) * self.chunks_x + (x >> CHUNK_SHIFT)
+		chunk = self.chunks.get(key)
+		if chunk is not None:
+			chunk[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)] = 0
+		
+	def has(self, x, y):
+		if not (0 <= x < self.width and 0 <= y < self.height):
+			return False
+		chunk = self.chunks.get((y >> CHUNK_SHIFT) * self.chunks_x + (x >> CHUNK_SHIFT))
+		return chunk is not None and chunk[((y & CHUNK_MASK) << CHUNK_SHIFT) | (x & CHUNK_MASK)] == 1
+		
+	def clear(self):
+		self.chunks.clear()
+		
+	def copy(self):
+		chunks = {key: chunk.copy() for key, chunk in self.chunks.items()}
+		return FOVMask(self.width, self.height, chunks)
+		
+	def indices(self):
+		#Yields y*width+x for each cell in the mask
+		width = self.width
+		for key, chunk in self.chunks.items():
+			cy, cx = divmod(key, self.chunks_x)
+			base_x = cx << CHUNK_SHIFT
+			base_y = cy << CHUNK_SHIFT
+			find = chunk.find
+			i = find(1)
+			while i != -1:
+				yield (base_y + (i >> CHUNK_SHIFT)) * width + base_x + (i & CHUNK_MASK)
+				i = find(1, i + 1)
+			
+	def __contains__(self, pos):
+		return self.has(pos.x, pos.y)
+		
+	def __iter__(self):
+		width = self.width
+		for i in self.indices():
+			y, x = divmod(i, width)
+			yield Point(x, y)
+			
+	def __len__(self):
+		return sum(chunk.count(1) for chunk in self.chunks.values())
+		
+	def __bool__(self):
+		return any(1 in chunk for chunk in self.chunks.values())
+		
+	def _check_size(self, other):
+		if (self.width, self.height) != (other.width, other.height):
+			raise ValueError("FOV masks must have the same dimensions")
+		
+	def __or__(self, other):
+		result = self.copy()
+		result |= other
+		return result
+		
+	def __and__(self, other):
+		self._check_size(other)
+		chunks = {}
+		for key, chunk in self.chunks.items():
+			if (other_chunk := other.chunks.get(key)) is not None:
+				chunks[key] = _bytes_op(chunk, other_chunk, lambda a, b: a & b)
+		return FOVMask(self.width, self.height, chunks)
+		
+	def __sub__(self, other):
+		self._check_size(other)
+		chunks = {}
+		for key, chunk in self.chunks.items():
+			if (other_chunk := other.chunks.get(key)) is not None:
+				chunks[key] = _bytes_op(chunk, other_chunk, lambda a, b: a & ~b)
+			else:
+				chunks[key] = chunk.copy()
+		return FOVMask(self.width, self.height, chunks)
+		
+	def __ior__(self, other):
+		self._check_size(other)
+		chunks = self.chunks
+		for key, other_chunk in other.chunks.items():
+			if (chunk := chunks.get(key)) is not None:
+				chunk[:] = _bytes_op(chunk, other_chunk, lambda a, b: a | b)
+			else:
+				chunks[key] = other_chunk.copy()
+		return self
+
+#Each quadrant maps (row, col) to (x, y) as x = ox + a*row + b*col, y = oy + c*row + d*col
+_QUADRANTS = [
+	(0, 1, -1, 0), #North
+	(0, 1, 1, 0), #South
+	(1, 0, 0, 1), #East
+	(-1, 0, 0, 1) #West
+]
+
+def _fog_map(board):
+	fog = {}
+	for pos, field in board.field_map.items():
+		fog[(pos.x, pos.y)] = field.transparency
+	return fog
+
+def shadowcast(board, origin, mark, radius=FOV_RADIUS):
+	#Symmetric shadowcasting. Slopes are kept as integer fractions (num, den) so that tie-breaking is exact.
+	#Rows are processed breadth-first rather than recursively, so that every row of a quadrant is visited in depth order
+	#and fog density can be carried forward from the previous row.
+	width = board.width
+	height = board.height
+	walls = board.walls
+	ox = origin.x
+	oy = origin.y
+	fog = _fog_map(board) if board.field_map else None
+
+	radius_sq = radius * radius
+	mark(ox, oy)
+	for a, b, c, d in _QUADRANTS:
+		#For each cell: (number of fog tiles passed through so far, lowest transparency seen)
+		fog_count = {}
+		queue = deque()
+		queue.append((1, -1, 1, 1, 1))
+		while queue:
+			depth, sn, sd, en, ed = queue.popleft()
+			if depth > radius:
+				continue
+			min_col = (2 * depth * sn + sd) // (2 * sd)
+			max_col = -((ed - 2 * depth * en) // (2 * ed))
+			prev_wall = None
+			for col in range(min_col, max_col + 1):
+				x = ox + a * depth + b * col
+				y = oy + c * depth + d * col
+
+				if 0 <= x < width and 0 <= y < height:
+					wall = walls[y * width + x] == 1
+					visible = depth * depth + col * col <= radius_sq
+				else:
+					wall = True
+					visible = False
+
+				if fog is not None and not wall:
+					if depth > 1:
+						pcol = (2 * col * (depth - 1) + depth) // (2 * depth)
+						count, transp = fog_count.get((depth - 1, pcol), (0, 9999))
+					else:
+						count, transp = 0, 9999
+					if count >= transp:
+						wall = True
+						visible = False
+					elif (t := fog.get((x, y))) is not None:
+						count += 1
+						transp = min(transp, t)
+						#Dense enough fog acts like a wall for everything behind it
+						wall = count >= transp
+					fog_count[(depth, col)] = (count, transp)
+
+				if visible and (wall or (col * sd >= depth * sn and col * ed <= depth * en)):
+					mark(x, y)
+
+				if prev_wall is not None:
+					if prev_wall and not wall:
+						sn = 2 * col - 1
+						sd = 2 * depth
+					elif not prev_wall and wall:
+						queue.append((depth + 1, sn, sd, 2 * col - 1, 2 * depth))
+				prev_wall = wall
+
+			if prev_wall is False:
+				queue.append((depth + 1, sn, sd, en, ed))
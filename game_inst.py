@@ -2,7 +2,7 @@ from const import *
 
 from items import *
 from json_obj import *
-from board import Board
+from board import Board, BoardPregen
 from entity import Entity
 from monster import Monster
 from player import Player
@@ -40,7 +40,7 @@ class Game:
 		return cls.get_instance()
 	
 	def __init__(self):
-		self._board = Board(50, 18)
+		self._board = Board(BOARD_WIDTH, BOARD_HEIGHT)
 		self._player = Player()
 		self.screen = None
 		self.monsters = []
@@ -55,20 +55,46 @@ class Game:
 		self.tick = 0
 		self.select_mon = None
 		self.noise_events = []
-		self.revealed = set()
 		self.delay = False
 		self.last_save_turn = -999
 		self.last_save_time = time.time()
 		self.projectile = None
+		#The next level is generated in the background while this one is played; see start_pregen
+		self.pregen = None
+		self.level_pack = None
+		self.level_pack_path = None
+		self.set_seed(random.getrandbits(64))
 		
 	def __getstate__(self):
 		d = self.__dict__.copy()
-		for field in ["screen", "mon_types", "eff_types", "weap_types", "armor_types"]:
+		for field in ["screen", "mon_types", "eff_types", "weap_types", "armor_types", "pregen", "level_pack"]:
 			del d[field]
+		d["combat_state"] = random.getstate()
 		return d
 	
 	def __setstate__(self, state):
+		random.setstate(state.pop("combat_state"))
 		self.__dict__.update(state)
+		#The worker thread doesn't survive saving and loading, so start it again; it's the same level, since it only depends on the seed
+		self.pregen = None
+		self.level_pack = None
+		if self.level_pack_path:
+			self.open_level_pack(self.level_pack_path)
+		self.start_pregen()
+		
+	def set_seed(self, seed):
+		#Everything random in a game comes from streams derived from this master seed:
+		#each level is generated from its own streams (see level_rng), so it depends only on the seed and its depth;
+		#monster decisions and the tie-breaks in their path searches use ai_rng; and combat, skill checks and every other roll
+		#during play use the random module itself, seeded here.
+		self.seed = seed
+		self.ai_rng = derive_rng(seed, "ai")
+		self.get_board().path_rng = self.ai_rng
+		random.seed(derive_rng(seed, "combat").getrandbits(64))
+		
+	def level_rng(self, depth, stream):
+		#stream is "map" for the layout or "spawns" for placing the player, monsters and items
+		return derive_rng(self.seed, "level", depth, stream)
 		
 	def autosave(self):
 		time_diff = time.time() - self.last_save_time
@@ -184,6 +210,8 @@ class Game:
 		self.load_json_data()
 		
 		if not self.check_saved_game():
+			if LEVEL_PACK_PATH:
+				self.open_level_pack(LEVEL_PACK_PATH)
 			self.init_player()
 			self.generate_level()
 			self.add_message("Welcome to the Dungeon Roguelike game! Press '?' to view controls.")
@@ -227,32 +255,96 @@ class Game:
 		if player.debug_wizard:
 			self.level = self.input_int("As the wizard of debugging, you choose which level to go to. Which level number would you like to teleport to?")
 		
-		self.generate_level()
-		self.refresh_mon_pos_cache()
+		#The level waiting in the background is for the next depth down, so jumping anywhere else generates one on the spot
+		board = None
+		if self.pregen and self.pregen.depth == self.level:
+			board = self.pregen.result()
+		
+		self.generate_level(board)
 		self.save()		
 		self.draw_board()
 		
-	def generate_level(self):
-		board = self.get_board()
+	def generate_level(self, board=None):
+		#If board is given, it's an already generated level to swap in (from BoardPregen); otherwise the level is taken from
+		#the level pack if it has one for this depth, or generated now
+		if not board and (index := self.pick_packed_level(self.level)) is not None:
+			self.load_packed_level(index)
+		else:
+			self.build_level(board)
+		self.start_pregen()
 		
+	def build_level(self, board=None):
 		self.monsters.clear()
-		self.revealed.clear()
 		
-		board.clear_los_cache()
-		board.clear_collision_cache()
-		board.procgen_level()
-		self.place_player()
-		self.place_monsters()
-		self.place_items()
+		if board:
+			self.swap_board(board)
+		else:
+			board = self.get_board()
+			board.clear_los_cache()
+			board.clear_collision_cache()
+			board.procgen_level(self.level_rng(self.level, "map"))
+		rand = self.level_rng(self.level, "spawns")
+		self.place_player(rand)
+		self.place_monsters(rand)
+		self.place_items(rand)
+		
+	def swap_board(self, board):
+		old_board = self.get_board()
+		old_board.stop_los_matrix()
+		board.player = old_board.player
+		board.path_rng = self.ai_rng
+		self._board = board
+		
+	def start_pregen(self):
+		#Start generating the next level in the background, unless it's coming from the level pack
+		board = self.get_board()
+		depth = self.level + 1
+		if self.pick_packed_level(depth) is not None:
+			self.pregen = None
+			return
+		self.pregen = BoardPregen(board.width, board.height, depth, self.level_rng(depth, "map"), board.precompute_los)
+		
+	def open_level_pack(self, path):
+		from levelpack import LevelPack
+		self.level_pack = LevelPack(path)
+		self.level_pack_path = path
 		
-	def choose_mon_spawn_pos(self):
+	def pick_packed_level(self, depth):
+		#Index of a level in the pack for this depth (the same one every time for a given seed), or None if there isn't one
+		pack = self.level_pack
+		board = self.get_board()
+		if pack is None or (pack.width, pack.height) != (board.width, board.height):
+			return None
+		if not (indices := pack.by_depth.get(depth)):
+			return None
+		return self.level_rng(depth, "pack").choice(indices)
+		
+	def load_packed_level(self, index):
+		from levelpack import make_item
+		level = self.level_pack.read(index)
+		self.monsters.clear()
+		
+		board = Board(level.width, level.height)
+		board.precompute_los = self.get_board().precompute_los
+		board.load_level(level.walls, level.initial_zones, level.corridor_lengths)
+		self.swap_board(board)
+		self.place_player_at(level.player)
+		#Starting energy and wand charges come from the pack; rand only keeps their throwaway rolls off the combat stream
+		rand = self.level_rng(level.depth, "spawns")
+		for id, pos, energy in level.monsters:
+			if (m := self.place_monster_at(id, pos, rand)):
+				m.energy = energy
+		for key, pos, state in level.items:
+			board.place_item_at(pos, make_item(self, key, state, rand))
+		
+	def choose_mon_spawn_pos(self, rand=random):
 		board = self.get_board()
 		player = self.get_player()
-		force_outside_fov = x_in_y(3, 4) and x_in_y(8, self.level + 8)
+		force_outside_fov = x_in_y(3, 4, rand) and x_in_y(8, self.level + 8, rand)
 		
 		for tries in range(150):
-			pos = board.random_pos()
-			if board.passable(pos) and not self.entity_at(pos):
+			pos = board.random_pos(rand)
+			if board.is_reachable(player.pos, pos) and not self.entity_at(pos):
 				if not (force_outside_fov and player.sees_pos(pos)):
 					return pos
 		
@@ -266,7 +358,7 @@ class Game:
 		typ = self.get_armor_type(id)
 		return Armor.from_type(typ)
 	
-	def place_items(self):
+	def place_items(self, rand=random):
 		board = self.get_board()
 		
 		potions = [
@@ -278,10 +370,10 @@ class Game:
 			[ForesightPotion, 12]
 		]
 		
-		for _ in range(rng(1, 5)):
-			pos = board.random_passable()
+		for _ in range(rand.randint(1, 5)):
+			pos = board.random_passable(rand=rand)
 			
-			typ = random_weighted(potions)
+			typ = random_weighted(potions, rand)
 			board.place_item_at(pos, typ())
 			
 		weapons = [
@@ -295,10 +387,10 @@ class Game:
 			["greataxe", 5]
 		]
 		
-		for _ in range(rng(1, 5)):
-			if one_in(2):
-				pos = board.random_passable()
-				name = random_weighted(weapons)
+		for _ in range(rand.randint(1, 5)):
+			if one_in(2, rand):
+				pos = board.random_passable(rand=rand)
+				name = random_weighted(weapons, rand)
 				board.place_item_at(pos, self.create_weapon(name))
 				
 		armors = [
@@ -312,10 +404,10 @@ class Game:
 			["plate", 10]
 		]
 		
-		for _ in range(rng(2, 4)):
-			if one_in(2):
-				pos = board.random_passable()
-				name = random_weighted(armors)
+		for _ in range(rand.randint(2, 4)):
+			if one_in(2, rand):
+				pos = board.random_passable(rand=rand)
+				name = random_weighted(armors, rand)
 				board.place_item_at(pos, self.create_armor(name))
 				
 		scrolls = [
@@ -324,35 +416,35 @@ class Game:
 			[ThunderScroll, 20]
 		]
 		
-		for _ in range(rng(1, 3)):
-			if one_in(5):
-				pos = board.random_passable()	
-				typ = random_weighted(scrolls)
+		for _ in range(rand.randint(1, 3)):
+			if one_in(5, rand):
+				pos = board.random_passable(rand=rand)	
+				typ = random_weighted(scrolls, rand)
 				board.place_item_at(pos, typ())
 				
-		if x_in_y(3, 8):
+		if x_in_y(3, 8, rand):
 			wand_types = [
 				WandFlame,
 				WandConfuse
 			]
-			pos = board.random_passable()
-			board.place_item_at(pos, random.choice(wand_types)())
+			pos = board.random_passable(rand=rand)
+			board.place_item_at(pos, rand.choice(wand_types)(rand))
 				
-		if one_in(5):
-			pos = board.random_passable()
+		if one_in(5, rand):
+			pos = board.random_passable(rand=rand)
 			board.place_item_at(pos, Shield())
 		
-		if not one_in(5):	
-			num = rng(0, rng(0, rng(0, 9)))
+		if not one_in(5, rand):	
+			num = rand.randint(0, rand.randint(0, rand.randint(0, 9)))
 			for _ in range(num):
-				pos = board.random_passable()	
+				pos = board.random_passable(rand=rand)	
 				board.place_item_at(pos, Dart())
 		
-	def place_monsters(self):
+	def place_monsters(self, rand=random):
 		eligible_types = {}
 		highest = 0
 		
-		special = not x_in_y(10, self.level) and one_in(7)
+		special = not x_in_y(10, self.level, rand) and one_in(7, rand)
 		
 		levels = WeightedList()
 		for typ in self.get_all_monster_types():
@@ -367,48 +459,52 @@ class Game:
 				
 		assert len(eligible_types) > 0
 			
-		num_monsters = rng(5, 10)
-		num_monsters += rng(0, round((self.level-1)**(2/3)))
+		num_monsters = rand.randint(5, 10)
+		num_monsters += rand.randint(0, round((self.level-1)**(2/3)))
 		
 		packs = 0
 		while num_monsters > 0:
-			typ = random.choice(eligible_types[levels.pick()])
+			typ = rand.choice(eligible_types[levels.pick(rand)])
 			min_level = typ.level
-			if "PACK_TRAVEL" in typ.flags and x_in_y(self.level, self.level + 6) and one_in(6 + packs * 3):
-				pack_num = rng(3, 5)
-				if self.spawn_pack(typ.id, pack_num):
+			if "PACK_TRAVEL" in typ.flags and x_in_y(self.level, self.level + 6, rand) and one_in(6 + packs * 3, rand):
+				pack_num = rand.randint(3, 5)
+				if self.spawn_pack(typ.id, pack_num, rand):
 					num_monsters -= pack_num
 					packs += 1	
 			else:
 				num_monsters -= 1
-				self.place_monster(typ.id)
+				self.place_monster(typ.id, rand)
 		
-	def spawn_pack(self, typ, num):
+	def spawn_pack(self, typ, num, rand=random):
 		self.check_mon_type(typ)
 		board = self.get_board()
 		
-		pos = self.choose_mon_spawn_pos()
+		pos = self.choose_mon_spawn_pos(rand)
 		
 		if not pos:
 			return False
 		
-		candidates = []
+		nearby = []
 		for p in board.points_in_radius(pos, 6):
 			if not board.passable(p):
 				continue
 			if self.entity_at(p):
 				continue	
-			if one_in(2) or board.has_line_of_sight(p, pos):
+			nearby.append(p)
+			
+		candidates = []
+		for p, has_los in zip(nearby, board.los_many(pos, nearby)):
+			if one_in(2, rand) or has_los:
 				candidates.append(p)
 		if not candidates:
 			return False
 			
-		random.shuffle(candidates)
+		rand.shuffle(candidates)
 		candidates.sort(key=lambda p: p.distance(pos))
 		
 		num = min(len(candidates), num)
 		for i in range(num):
-			self.place_monster_at(typ, candidates[i])
+			self.place_monster_at(typ, candidates[i], rand)
 		
 	def deinit_window(self):
 		if not self.window_init:
@@ -433,43 +529,50 @@ class Game:
 		
 		board.player = player
 		
-	def place_player(self):
+	def place_player(self, rand=random):
 		board = self.get_board()
 		player = self.get_player()
 		while True:
-			pos = board.random_passable()
+			pos = board.random_passable(rand=rand)
 			for p in board.points_in_radius(pos, 1):
 				if p != pos and player.can_move_to(p):	
-					player.move_to(pos)
-					board.set_collision_cache(pos, player)
+					self.place_player_at(pos)
 					return
 					
+	def place_player_at(self, pos):
+		board = self.get_board()
+		player = self.get_player()
+		player.move_to(pos)
+		board.set_collision_cache(pos, player)
+					
 	def spawn_monster_at(self, m, pos):
 		board = self.get_board()
-		if m.move_to(pos):
+		#Unlike move_to, this leaves the monster's old position alone; a monster that just split off still shares it with the original
+		if m.can_move_to(pos) and not self.entity_at(pos):
+			m.pos = pos
 			board.set_collision_cache(pos, m)
 			self.monsters.append(m)
 			return True
 		return False
 					
-	def place_monster_at(self, typ_id, pos):
+	def place_monster_at(self, typ_id, pos, rand=random):
 		typ = self.get_mon_type(typ_id)
-		m = Monster.from_type(typ)
+		m = Monster.from_type(typ, rand)
 		
 		if self.spawn_monster_at(m, pos):
 			return m
 		else:
 			return None
 		
-	def place_monster(self, typ_id):
+	def place_monster(self, typ_id, rand=random):
 		typ = self.get_mon_type(typ_id)
 		board = self.get_board()
 		
-		pos = self.choose_mon_spawn_pos()
+		pos = self.choose_mon_spawn_pos(rand)
 		if not pos:
 			return None
 			
-		return self.place_monster_at(typ_id, pos)
+		return self.place_monster_at(typ_id, pos, rand)
 	
 	def entity_at(self, pos):
 		board = self.get_board()
@@ -483,9 +586,9 @@ class Game:
 		
 	def monsters_in_radius(self, pos, radius):
 		board = self.get_board()
-		for pos in board.points_in_radius(pos, radius):
-			if (mon := self.monster_at(pos)):
-				yield mon
+		for ent in board.entities_in_radius(pos, radius):
+			if ent.is_monster():
+				yield ent
 				
 	def once_every_num_turns(self, num):
 		return self.tick % num == 0
@@ -534,6 +637,7 @@ class Game:
 			m.energy += used	
 		
 		self.process_noise_events()	
+		board.bump_occupancy_version()
 		
 		while self.subtick_timer >= 100:
 			self.subtick_timer -= 100
@@ -548,8 +652,6 @@ class Game:
 		random.shuffle(remaining)
 		remaining.sort(key=lambda m: m.energy, reverse=True)
 		
-		self.refresh_mon_pos_cache()
-		
 		while len(remaining) > 0:
 			nextremain = []
 			for m in remaining:
@@ -565,21 +667,52 @@ class Game:
 		self.remove_dead()
 		self.process_noise_events()
 		
-		self.refresh_mon_pos_cache()
+		if DEBUG_CHECK_COLLISION:
+			self.check_mon_pos_cache()
 		
 	def items_at(self, pos):
 		board = self.get_board()
-		return board.get_tile(pos).items	
+		return board.items_at(pos)
 			
-	def refresh_mon_pos_cache(self):
+	def check_mon_pos_cache(self):
+		#The collision cache is kept up to date as entities move, spawn and die; this checks that it hasn't drifted
 		board = self.get_board()
 		player = self.get_player()
-		board.clear_collision_cache()
-		
-		board.set_collision_cache(player.pos, player)	
-		for m in self.monsters:
-			if m.is_alive():
-				board.set_collision_cache(m.pos, m)
+		expected = {}
+		for ent in [player] + self.monsters:
+			if not ent.is_alive():
+				continue
+			index = ent.pos.y * board.width + ent.pos.x
+			if index in expected:
+				raise AssertionError(f"{ent.get_name()} and {expected[index].get_name()} are both at {ent.pos}")
+			expected[index] = ent
+			
+		actual = board.mon_collision_cache
+		for index in expected.keys() | actual.keys():
+			ent = expected.get(index)
+			cached = actual.get(index)
+			if ent is not cached:
+				y, x = divmod(index, board.width)
+				ent_name = ent.get_name() if ent else "nothing"
+				cached_name = cached.get_name() if cached else "nothing"
+				raise AssertionError(f"collision cache at {Point(x, y)} has {cached_name}, but {ent_name} is there")
+
+		indexed = {}
+		for bucket in board.entity_index.buckets.values():
+			indexed.update(bucket)
+		if indexed != actual:
+			raise AssertionError("spatial index doesn't match the collision cache")
+			
+		for index, cost in enumerate(board.move_costs):
+			if board.walls[index]:
+				expected_cost = 0
+			elif (ent := actual.get(index)) and ent.is_monster():
+				expected_cost = OCCUPIED_PATH_COST
+			else:
+				expected_cost = 1
+			if cost != expected_cost:
+				y, x = divmod(index, board.width)
+				raise AssertionError(f"path cost at {Point(x, y)} is {cost}, expected {expected_cost}")
 		
 	def remove_dead(self):
 		for m in reversed(self.monsters):
@@ -588,9 +721,10 @@ class Game:
 				
 	def place_stairs(self):
 		board = self.get_board()
-		
+		#Make sure the stairs can be reached
+		component = board.component_at(self.get_player().pos)
 		for _ in range(5):
-			pos = board.random_passable()
+			pos = board.random_passable(component)
 			if not self.items_at(pos):
 				break
 		
@@ -623,54 +757,76 @@ class Game:
 			string = string[:diff]
 		screen.addstr(row, col, string, color)	 
 		
-	def draw_walls(self, offset_y):	
+	def get_view_size(self):
+		board = self.get_board()
+		return min(board.width, VIEW_WIDTH), min(board.height, VIEW_HEIGHT)
+		
+	def get_camera(self):
+		#The top-left corner of the part of the board shown on screen, which follows the player on boards larger than the view
 		board = self.get_board()
 		player = self.get_player()
-		height = board.height
-		width = board.width
+		view_w, view_h = self.get_view_size()
+		x = clamp(player.pos.x - view_w // 2, 0, board.width - view_w)
+		y = clamp(player.pos.y - view_h // 2, 0, board.height - view_h)
+		return Point(x, y)
+		
+	def draw_map_symbol(self, pos, symbol, color, offset_y, camera):
+		view_w, view_h = self.get_view_size()
+		x = pos.x - camera.x
+		y = pos.y - camera.y
+		if 0 <= x < view_w and 0 <= y < view_h:
+			self.draw_symbol(y + offset_y, x, symbol, color)
+		
+	def draw_walls(self, offset_y, camera):	
+		board = self.get_board()
 		player = self.get_player()
-		
-		for pos in board.iter_square(0, 0, width-1, height-1):
-			tile = board.get_tile(pos)
-			if not tile.revealed:
-				continue
-				
-			seen = player.sees_pos(pos)
-			color = 0 if seen else curses.color_pair(COLOR_GRAY)
-				
-			if tile.wall:
-				symbol = WALL_SYMBOL
-			elif seen and board.field_at(pos):
-				symbol = "8"
-				color = curses.color_pair(COLOR_SILVER) | curses.A_REVERSE
+		width = board.width
+		view_w, view_h = self.get_view_size()
+		
+		fov = player.fov
+		revealed = board.revealed
+		walls = board.walls
+		stairs = board.stairs
+		item_map = board.item_map
+		for y in range(camera.y, camera.y + view_h):
+			for x in range(camera.x, camera.x + view_w):
+				if not revealed.has(x, y):
+					continue
+				i = y * width + x
+				seen = fov.has(x, y)
+				color = 0 if seen else curses.color_pair(COLOR_GRAY)
+					
+				if walls[i]:
+					symbol = WALL_SYMBOL
+				elif seen and board.field_at(Point(x, y)):
+					symbol = "8"
+					color = curses.color_pair(COLOR_SILVER) | curses.A_REVERSE
+					
+				elif seen and (items := item_map.get(i)):
+					item = items[-1]
+					symbol = item.symbol
+					color = item.display_color()
+				elif stairs[i]:
+					symbol = STAIR_SYMBOL
+				else:
+					symbol = "." if seen else " "
+					if seen:
+						color = curses.color_pair(COLOR_GRAY)
 				
-			elif seen and tile.items:
-				item = tile.items[-1]
-				symbol = item.symbol
-				color = item.display_color()
-			elif tile.stair:
-				symbol = STAIR_SYMBOL
-			else:
-				symbol = "." if seen else " "
-				if seen:
-					color = curses.color_pair(COLOR_GRAY)
-			
-			self.draw_symbol(pos.y + offset_y, pos.x, symbol, color)
+				self.draw_symbol(y - camera.y + offset_y, x - camera.x, symbol, color)
 	
-	def maybe_draw_projectile(self, offset_y):
+	def maybe_draw_projectile(self, offset_y, camera):
 		if not self.projectile:
 			return
 		player = self.get_player()
 		proj = self.projectile
 		
 		if player.sees_pos(proj):
-			self.draw_symbol(proj.y + offset_y, proj.x, "*")
+			self.draw_map_symbol(proj, "*", 0, offset_y, camera)
 	
 		
 	def draw_stats(self):
-		board = self.get_board()
-		height = board.height
-		width = board.width
+		width, _ = self.get_view_size()
 		player = self.get_player()
 		
 		bar = "HP: " + display_bar(player.HP, player.MAX_HP, 20)			
@@ -743,7 +899,7 @@ class Game:
 				if i >= 12:
 					break
 					
-	def draw_monsters(self, offset_y):
+	def draw_monsters(self, offset_y, camera):
 		player = self.get_player()
 		for m in player.visible_monsters():
 			pos = m.pos
@@ -752,19 +908,18 @@ class Game:
 			color = m.display_color()
 			if m is self.select_mon:
 				color = curses.color_pair(COLOR_GREEN) | curses.A_REVERSE
-			self.draw_symbol(pos.y + offset_y, pos.x, symbol, color)	
+			self.draw_map_symbol(pos, symbol, color, offset_y, camera)	
 		
-		pos = player.pos
-		self.draw_symbol(pos.y + offset_y, pos.x, PLAYER_SYMBOL, curses.A_REVERSE)
+		self.draw_map_symbol(player.pos, PLAYER_SYMBOL, curses.A_REVERSE, offset_y, camera)
 	
 	def draw_messages(self, offset_y):
 		screen = self.screen
 		
 		messages = self.msg_log.get_messages(8)
-		board = self.get_board()
-		y = board.height + offset_y
+		view_w, view_h = self.get_view_size()
+		y = view_h + offset_y
 		rows, _ = screen.getmaxyx()
-		cols = board.width + 4
+		cols = view_w + 4
 		groups = []
 		
 		total_lines = 0
@@ -789,8 +944,7 @@ class Game:
 	def reveal_seen_tiles(self):
 		board = self.get_board()
 		player = self.get_player()
-		for pos in player.fov:
-			board.reveal_tile_at(pos)
+		board.revealed |= player.fov
 				
 	def draw_board(self):
 		screen = self.screen
@@ -805,9 +959,10 @@ class Game:
 			board.recalc_sight = False
 		
 		self.reveal_seen_tiles()
-		self.draw_walls(offset_y)
-		self.draw_monsters(offset_y)
-		self.maybe_draw_projectile(offset_y)
+		camera = self.get_camera()
+		self.draw_walls(offset_y, camera)
+		self.draw_monsters(offset_y, camera)
+		self.maybe_draw_projectile(offset_y, camera)
 		self.draw_stats()
 		self.draw_messages(offset_y+1)
 		screen.move(20 + offset_y, 0)
@@ -386,12 +386,12 @@ class Shield(Item):
 class Wand(Item):
 	description = "A magical wand that can be used to cast a spell at a creature."
 	
-	def __init__(self, spell):
+	def __init__(self, spell, rand=random):
 		super().__init__()
 		self.name = "wand"
 		self.symbol = "Î"
 		self.spell = spell
-		self.charges = triangular_roll(1, 7)
+		self.charges = triangular_roll(1, 7, rand)
 		
 	def display_color(self):
 		return curses.color_pair(COLOR_MAGENTA)
@@ -421,12 +421,12 @@ class Wand(Item):
 		
 class WandFlame(Wand):
 	
-	def __init__(self):
-		super().__init__(FlameSpell())
+	def __init__(self, rand=random):
+		super().__init__(FlameSpell(), rand)
 		self.name = "wand of flame"
 		
 class WandConfuse(Wand):
 	
-	def __init__(self):
-		super().__init__(ConfusionSpell())
+	def __init__(self, rand=random):
+		super().__init__(ConfusionSpell(), rand)
 		self.name = "wand of confusion"
\ No newline at end of file
@@ -0,0 +1,247 @@
+#Pre-generated levels, stored in a compact binary pack so the game can load one with a single seek instead of generating it.
+#Run with "python3 levelpack.py levels.pack -n 5000 --depths 1-10"; set LEVEL_PACK_PATH in const.py to play from the pack.
+#Layout (little-endian): a header, then an index with one (offset, size, depth, seed) entry per level, then the levels.
+#Each level is its walls as a bitplane (one bit per cell, row-major), the player's start, what procgen reported (the number
+#of zones before they were joined and the corridor lengths), the monster spawns as (x, y, starting energy, name) and the item
+#spawns as (x, y, state, name), where state is what generation rolled for the item (a wand's charges; 0 for other items). A level is generated from (seed, depth) exactly as the game would; see Game.set_seed.
+import argparse, os, random, struct, time
+from multiprocessing import Pool
+
+import items
+from items import Weapon, Armor, Wand
+from board import Board
+from const import *
+from utils import Point, derive_rng
+
+MAGIC = b"RLPK"
+VERSION = 4
+HEADER = struct.Struct("<4sHHHI")
+INDEX_ENTRY = struct.Struct("<QIHQ")
+POS = struct.Struct("<HH")
+COUNT = struct.Struct("<H")
+SPAWN = struct.Struct("<HHBB")
+MONSTER_SPAWN = struct.Struct("<HHhB")
+
+TO_DIGITS = bytes.maketrans(b"\x00\x01", b"01")
+FROM_DIGITS = bytes.maketrans(b"01", b"\x00\x01")
+
+def pack_bits(cells):
+	#cells is a sequence of 0s and 1s; the first cell is the highest bit of the first byte, and the last byte is padded with 0s
+	num = len(cells)
+	pad = -num % 8
+	value = int(bytes(cells).translate(TO_DIGITS), 2) if num else 0
+	return (value << pad).to_bytes((num + pad) // 8, "big")
+
+def unpack_bits(data, num):
+	value = int.from_bytes(data, "big") >> (-num % 8)
+	return bytearray(format(value, f"0{num}b").encode().translate(FROM_DIGITS))
+
+def item_key(item):
+	#Weapons and armor are made from their JSON types; everything else placed on a level is a plain item class
+	if isinstance(item, Weapon):
+		return "weapon:" + item.type.id
+	if isinstance(item, Armor):
+		return "armor:" + item.type.id
+	return type(item).__name__
+
+def item_state(item):
+	#The one roll made when an item is generated that its class doesn't determine
+	return item.charges if isinstance(item, Wand) else 0
+
+def make_item(g, key, state, rand=random):
+	kind, _, id = key.partition(":")
+	if kind == "weapon":
+		return g.create_weapon(id)
+	if kind == "armor":
+		return g.create_armor(id)
+	cls = getattr(items, key)
+	if issubclass(cls, Wand):
+		item = cls(rand)
+		item.charges = state
+		return item
+	return cls()
+
+class PackedLevel:
+
+	def __init__(self, width, height, depth, seed, walls, player, initial_zones, corridor_lengths, monsters, items):
+		self.width = width
+		self.height = height
+		self.depth = depth
+		self.seed = seed
+		self.walls = walls
+		self.player = player
+		self.initial_zones = initial_zones
+		self.corridor_lengths = corridor_lengths
+		self.monsters = monsters
+		self.items = items
+
+def encode_level(g):
+	board = g.get_board()
+	player = g.get_player()
+	placed = []
+	for index in sorted(board.item_map):
+		y, x = divmod(index, board.width)
+		placed.extend((item_key(item), Point(x, y), item_state(item)) for item in board.item_map[index])
+
+	parts = [pack_bits(board.walls), POS.pack(player.pos.x, player.pos.y)]
+	corridors = board.corridor_lengths
+	parts.append(COUNT.pack(board.initial_zones))
+	parts.append(COUNT.pack(len(corridors)))
+	parts.append(struct.pack(f"<{len(corridors)}H", *corridors))
+	parts.append(COUNT.pack(len(g.monsters)))
+	for m in g.monsters:
+		name = m.id.encode()
+		parts.append(MONSTER_SPAWN.pack(m.pos.x, m.pos.y, m.energy, len(name)))
+		parts.append(name)
+	parts.append(COUNT.pack(len(placed)))
+	for name, pos, state in placed:
+		name = name.encode()
+		parts.append(SPAWN.pack(pos.x, pos.y, state, len(name)))
+		parts.append(name)
+	return b"".join(parts)
+
+def decode_level(data, width, height, depth, seed):
+	num = width * height
+	offset = (num + 7) // 8
+	walls = unpack_bits(data[:offset], num)
+	player = Point(*POS.unpack_from(data, offset))
+	offset += POS.size
+	initial_zones, count = struct.unpack_from("<HH", data, offset)
+	offset += 4
+	corridor_lengths = list(struct.unpack_from(f"<{count}H", data, offset))
+	offset += 2 * count
+	monsters = []
+	count, = COUNT.unpack_from(data, offset)
+	offset += COUNT.size
+	for _ in range(count):
+		x, y, energy, length = MONSTER_SPAWN.unpack_from(data, offset)
+		offset += MONSTER_SPAWN.size
+		monsters.append((data[offset:offset + length].decode(), Point(x, y), energy))
+		offset += length
+	placed = []
+	count, = COUNT.unpack_from(data, offset)
+	offset += COUNT.size
+	for _ in range(count):
+		x, y, state, length = SPAWN.unpack_from(data, offset)
+		offset += SPAWN.size
+		placed.append((data[offset:offset + length].decode(), Point(x, y), state))
+		offset += length
+	return PackedLevel(width, height, depth, seed, walls, player, initial_zones, corridor_lengths, monsters, placed)
+
+class LevelPack:
+	#Reads the header and index once; after that, each level is read with one seek
+
+	def __init__(self, path):
+		self.path = path
+		self.file = open(path, "rb")
+		magic, version, self.width, self.height, count = HEADER.unpack(self.file.read(HEADER.size))
+		if magic != MAGIC or version != VERSION:
+			self.file.close()
+			raise ValueError(f"{path!r} is not a level pack (version {VERSION})")
+		self.entries = list(INDEX_ENTRY.iter_unpack(self.file.read(INDEX_ENTRY.size * count)))
+		self.by_depth = {}
+		for index, (offset, size, depth, seed) in enumerate(self.entries):
+			self.by_depth.setdefault(depth, []).append(index)
+
+	def __len__(self):
+		return len(self.entries)
+
+	def read(self, index):
+		offset, size, depth, seed = self.entries[index]
+		self.file.seek(offset)
+		return decode_level(self.file.read(size), self.width, self.height, depth, seed)
+
+	def close(self):
+		self.file.close()
+
+_game = None
+
+def _init_worker():
+	global _game
+	from game_inst import Game
+	from entity import Entity
+	from spell import Spell
+	g = Game()
+	Entity.g = g
+	Spell.g = g
+	g.load_json_data()
+	_game = g
+
+def _generate(job):
+	seed, depth, width, height = job
+	g = _game
+	board = g._board = Board(width, height)
+	board.player = g.get_player()
+	g.set_seed(seed)
+	g.level = depth
+	g.build_level()
+	return encode_level(g)
+
+def make_jobs(seed, count, depths, width, height):
+	#(level seed, depth, width, height) for each level, with the levels spread evenly across the depths
+	jobs = []
+	for i in range(count):
+		depth = depths[i % len(depths)]
+		jobs.append((derive_rng(seed, "pack", i).getrandbits(64), depth, width, height))
+	return jobs
+
+def generate_levels(jobs, processes=None):
+	#Yields each job's level, encoded as in a pack, in order
+	with Pool(processes, initializer=_init_worker) as pool:
+		yield from pool.imap(_generate, jobs, chunksize=8)
+
+def write_pack(path, jobs, width, height, processes=None):
+	with open(path, "wb") as file:
+		file.write(HEADER.pack(MAGIC, VERSION, width, height, len(jobs)))
+		#Leave room for the index, and fill it in once the sizes of the levels are known
+		index_start = file.tell()
+		file.seek(INDEX_ENTRY.size * len(jobs), os.SEEK_CUR)
+		index = []
+		for (seed, depth, _, _), data in zip(jobs, generate_levels(jobs, processes)):
+			index.append(INDEX_ENTRY.pack(file.tell(), len(data), depth, seed))
+			file.write(data)
+		file.seek(index_start)
+		file.write(b"".join(index))
+
+def parse_depths(text):
+	#"3" or "1-10"
+	first, _, last = text.partition("-")
+	return list(range(int(first), int(last or first) + 1))
+
+def add_generation_args(parser):
+	parser.add_argument("-n", "--count", type=int, default=1000, help="number of levels")
+	parser.add_argument("--depths", type=parse_depths, default=[1], help="depth or range of depths, e.g. 1-10; levels are spread evenly across them")
+	parser.add_argument("--seed", type=int, default=None, help="seed for the whole batch")
+	parser.add_argument("--width", type=int, default=BOARD_WIDTH)
+	parser.add_argument("--height", type=int, default=BOARD_HEIGHT)
+	parser.add_argument("-j", "--processes", type=int, default=None, help="worker processes (default: one per CPU)")
+
+def enter_game_dir(*paths):
+	#The game loads its JSON data relative to the working directory, so switch to the game's directory.
+	#Returns the given paths made absolute first, so they still point where the user meant (None stays None).
+	paths = [path and os.path.abspath(path) for path in paths]
+	os.chdir(os.path.dirname(os.path.abspath(__file__)))
+	return paths
+
+def jobs_from_args(args):
+	#(seed, jobs) for the options added by add_generation_args
+	seed = args.seed if args.seed is not None else random.getrandbits(64)
+	return seed, make_jobs(seed, args.count, args.depths, args.width, args.height)
+
+def main():
+	parser = argparse.ArgumentParser(description="Pre-generate levels into a level pack")
+	parser.add_argument("output")
+	add_generation_args(parser)
+	args = parser.parse_args()
+
+	output, = enter_game_dir(args.output)
+	seed, jobs = jobs_from_args(args)
+
+	start = time.perf_counter()
+	write_pack(output, jobs, args.width, args.height, args.processes)
+	elapsed = time.perf_counter() - start
+	size = os.path.getsize(output)
+	print(f"Wrote {args.count} levels to {args.output} ({size / 1024:.1f} KiB) in {elapsed:.2f} s, seed {seed}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,193 @@
+#Level quality metrics, for tuning the generator. Run with "python3 levelstats.py levels.pack" to score a pack written by levelpack.py,
+#or "python3 levelstats.py --generate -n 10000" to generate a batch on the spot; add "--csv out.csv" for one row per level.
+#With NumPy, levels are scored in batches: the walls of a whole batch are stacked into one array and every metric, including the
+#breadth-first search for distances, is computed across the whole stack at once.
+import argparse, csv, time
+from levelpack import LevelPack, add_generation_args, decode_level, enter_game_dir, generate_levels, jobs_from_args
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+BATCH_SIZE = 1024
+
+class LevelStats:
+
+	def __init__(self, open_ratio, dead_ends, distances, initial_zones=None, corridor_lengths=None):
+		self.open_ratio = open_ratio #Open cells as a fraction of the cells inside the border
+		self.dead_ends = dead_ends #Open cells with only one open neighbor
+		self.distances = distances #distances[d] is the number of cells d steps from the player's start
+		self.initial_zones = initial_zones #Separate zones before procgen joined them
+		self.corridor_lengths = corridor_lengths #Walls dug out for each corridor that joined them
+
+	def reachable(self):
+		return sum(self.distances)
+
+	def max_distance(self):
+		return len(self.distances) - 1
+
+	def mean_distance(self):
+		return sum(d * num for d, num in enumerate(self.distances)) / self.reachable()
+
+def analyze(walls, width, height, start):
+	#Open ratio, dead ends and distances for one level; walls is one byte per cell, row-major, and start is a Point
+	if np is not None:
+		return analyze_batch(np.frombuffer(bytes(walls), dtype=np.uint8).reshape(1, height, width), [start])[0]
+	open_cells = sum(walls[y * width + 1:(y + 1) * width - 1].count(0) for y in range(1, height - 1))
+	dead_ends = 0
+	for index, wall in enumerate(walls):
+		if not wall:
+			y, x = divmod(index, width)
+			neighbors = (x > 0 and not walls[index - 1]) + (x < width - 1 and not walls[index + 1])
+			neighbors += (y > 0 and not walls[index - width]) + (y < height - 1 and not walls[index + width])
+			dead_ends += neighbors == 1
+
+	seen = {start.y * width + start.x}
+	frontier = list(seen)
+	distances = []
+	while frontier:
+		distances.append(len(frontier))
+		next_frontier = []
+		for curr in frontier:
+			y, x = divmod(curr, width)
+			for n, ok in ((curr - 1, x > 0), (curr + 1, x < width - 1), (curr - width, y > 0), (curr + width, y < height - 1)):
+				if ok and not walls[n] and n not in seen:
+					seen.add(n)
+					next_frontier.append(n)
+		frontier = next_frontier
+	return LevelStats(open_cells / ((width - 2) * (height - 2)), dead_ends, distances)
+
+def analyze_batch(walls, starts):
+	#walls is a (levels, height, width) array of 0s and 1s, and starts has a Point for each level
+	count, height, width = walls.shape
+	is_open = walls == 0
+	padded = np.pad(is_open, ((0, 0), (1, 1), (1, 1)))
+	neighbors = padded[:, :-2, 1:-1].astype(np.uint8) + padded[:, 2:, 1:-1] + padded[:, 1:-1, :-2] + padded[:, 1:-1, 2:]
+	dead_ends = (is_open & (neighbors == 1)).sum(axis=(1, 2))
+	open_ratio = is_open[:, 1:-1, 1:-1].mean(axis=(1, 2))
+
+	#Breadth-first search from every start at once: each step grows the frontiers by one cell in each direction
+	dist = np.full(walls.shape, -1, dtype=np.int32)
+	frontier = np.zeros(walls.shape, dtype=bool)
+	frontier[np.arange(count), [p.y for p in starts], [p.x for p in starts]] = True
+	frontier &= is_open
+	seen = frontier.copy()
+	depth = 0
+	while frontier.any():
+		dist[frontier] = depth
+		grown = np.zeros_like(frontier)
+		grown[:, 1:] |= frontier[:, :-1]
+		grown[:, :-1] |= frontier[:, 1:]
+		grown[:, :, 1:] |= frontier[:, :, :-1]
+		grown[:, :, :-1] |= frontier[:, :, 1:]
+		frontier = grown & is_open & ~seen
+		seen |= frontier
+		depth += 1
+
+	#One histogram per level, from a single bincount over (level, distance) pairs
+	levels, ys, xs = np.nonzero(dist >= 0)
+	span = max(depth, 1)
+	counts = np.bincount(levels * span + dist[levels, ys, xs], minlength=count * span).reshape(count, span)
+	stats = []
+	for i in range(count):
+		row = counts[i]
+		distances = row[:np.count_nonzero(row)].tolist()
+		stats.append(LevelStats(float(open_ratio[i]), int(dead_ends[i]), distances))
+	return stats
+
+def analyze_levels(levels):
+	#Stats for each of a sequence of PackedLevels, which must all be the same size
+	levels = list(levels)
+	if not levels:
+		return []
+	if np is not None:
+		width = levels[0].width
+		height = levels[0].height
+		walls = np.frombuffer(b"".join(bytes(level.walls) for level in levels), dtype=np.uint8).reshape(len(levels), height, width)
+		stats = analyze_batch(walls, [level.player for level in levels])
+	else:
+		stats = [analyze(level.walls, level.width, level.height, level.player) for level in levels]
+	for level, level_stats in zip(levels, stats):
+		level_stats.initial_zones = level.initial_zones
+		level_stats.corridor_lengths = level.corridor_lengths
+	return stats
+
+def batches(levels):
+	batch = []
+	for level in levels:
+		batch.append(level)
+		if len(batch) >= BATCH_SIZE:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+def describe(name, values):
+	values = sorted(values)
+	if not values:
+		return f"  {name}: none"
+	mean = sum(values) / len(values)
+	median = values[len(values) // 2]
+	return f"  {name}: mean {mean:.2f}, median {median:.2f}, min {values[0]:.2f}, max {values[-1]:.2f}"
+
+def report(results):
+	#results is a list of (level, stats) pairs
+	stats = [s for _, s in results]
+	print(f"{len(stats)} levels")
+	print(describe("Open area ratio", [s.open_ratio for s in stats]))
+	print(describe("Zones before joining", [s.initial_zones for s in stats]))
+	print(describe("Corridors per level", [len(s.corridor_lengths) for s in stats]))
+	print(describe("Corridor length", [n for s in stats for n in s.corridor_lengths]))
+	print(describe("Dead ends", [s.dead_ends for s in stats]))
+	print(describe("Cells reachable from the start", [s.reachable() for s in stats]))
+	print(describe("Mean distance from the start", [s.mean_distance() for s in stats]))
+	print(describe("Max distance from the start", [s.max_distance() for s in stats]))
+	#Distances from the start over every level, as the share of reachable cells in each band of 10 steps
+	bands = {}
+	for s in stats:
+		for d, num in enumerate(s.distances):
+			bands[d // 10] = bands.get(d // 10, 0) + num
+	total = sum(bands.values())
+	print("  Distance from the start, all levels:")
+	for band in sorted(bands):
+		print(f"    {band * 10:>4}-{band * 10 + 9:<4} {100 * bands[band] / total:5.1f}%")
+
+def write_csv(path, results):
+	with open(path, "w", newline="") as file:
+		writer = csv.writer(file)
+		writer.writerow(["depth", "seed", "open_ratio", "initial_zones", "corridors", "corridor_cells", "dead_ends", "reachable", "mean_distance", "max_distance"])
+		for level, s in results:
+			writer.writerow([level.depth, level.seed, f"{s.open_ratio:.4f}", s.initial_zones, len(s.corridor_lengths), sum(s.corridor_lengths),
+				s.dead_ends, s.reachable(), f"{s.mean_distance():.2f}", s.max_distance()])
+
+def main():
+	parser = argparse.ArgumentParser(description="Report level quality metrics for a level pack or a freshly generated batch")
+	parser.add_argument("pack", nargs="?", help="level pack written by levelpack.py")
+	parser.add_argument("--generate", action="store_true", help="generate levels instead of reading a pack")
+	parser.add_argument("--csv", help="also write one row per level to this file")
+	add_generation_args(parser)
+	args = parser.parse_args()
+	if not args.pack and not args.generate:
+		parser.error("give a level pack, or --generate")
+
+	start = time.perf_counter()
+	if args.generate:
+		args.csv, = enter_game_dir(args.csv)
+		seed, jobs = jobs_from_args(args)
+		levels = (decode_level(data, width, height, depth, level_seed) for (level_seed, depth, width, height), data in zip(jobs, generate_levels(jobs, args.processes)))
+	else:
+		pack = LevelPack(args.pack)
+		levels = (pack.read(i) for i in range(len(pack)))
+	results = []
+	for batch in batches(levels):
+		results.extend(zip(batch, analyze_levels(batch)))
+	elapsed = time.perf_counter() - start
+
+	report(results)
+	print(f"Scored in {elapsed:.2f} s ({len(results) / max(elapsed, 1e-9):.0f} levels per second)")
+	if args.csv:
+		write_csv(args.csv, results)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,197 @@
+from threading import Thread
+from collections import OrderedDict
+
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+#Rough memory cost of one LOSCache entry (an int key in an OrderedDict)
+_CACHE_ENTRY_BYTES = 100
+
+def clear_line(walls, width, x1, y1, x2, y2):
+	#Same rules as Board._check_simple_los: every cell on the line must be open, and diagonal steps can't squeeze between two walls
+	dx = abs(x2 - x1)
+	sx = 1 if x1 < x2 else -1
+	dy = -abs(y2 - y1)
+	sy = 1 if y1 < y2 else -1
+	error = dx + dy
+
+	x = x1
+	y = y1
+	if walls[y * width + x]:
+		return False
+	while x != x2 or y != y2:
+		old_x = x
+		old_y = y
+		e2 = 2 * error
+		if e2 >= dy:
+			if x == x2:
+				break
+			error += dy
+			x += sx
+		if e2 <= dx:
+			if y == y2:
+				break
+			error += dx
+			y += sy
+		if x != old_x and y != old_y:
+			if walls[old_y * width + x] and walls[y * width + old_x]:
+				return False
+		if walls[y * width + x]:
+			return False
+	return True
+
+def clear_lines_numpy(walls, x1, y1, x2, y2):
+	#Vectorized version of clear_line: traces every line at once, one Bresenham step per iteration.
+	#walls is a 2D bool array indexed [y, x]; the rest are int arrays of the same length.
+	x = x1.copy()
+	y = y1.copy()
+	dx = np.abs(x2 - x1)
+	sx = np.where(x1 < x2, 1, -1)
+	dy = -np.abs(y2 - y1)
+	sy = np.where(y1 < y2, 1, -1)
+	error = dx + dy
+	
+	clear = ~walls[y, x]
+	active = clear & ((x != x2) | (y != y2))
+	while active.any():
+		old_x = x.copy()
+		old_y = y.copy()
+		e2 = 2 * error
+		step_x = active & (e2 >= dy)
+		stop = step_x & (x == x2)
+		step_x &= ~stop
+		error = np.where(step_x, error + dy, error)
+		x = np.where(step_x, x + sx, x)
+		step_y = active & ~stop & (e2 <= dx)
+		stop_y = step_y & (y == y2)
+		stop |= stop_y
+		step_y &= ~stop_y
+		error = np.where(step_y, error + dx, error)
+		y = np.where(step_y, y + sy, y)
+		
+		moved = active & ~stop
+		squeeze = moved & step_x & step_y & walls[old_y, x] & walls[y, old_x]
+		blocked = moved & (squeeze | walls[y, x])
+		clear &= ~blocked
+		active &= ~stop & ~blocked & ((x != x2) | (y != y2))
+	return clear
+	
+class LOSMatrix:
+	#Packed, symmetric line-of-sight matrix between every pair of open cells on a level.
+	#Open cells are numbered 0..n-1, and the pair (i, j) with i < j is stored at bit j*(j-1)//2 + i.
+
+	def __init__(self, width, height, walls):
+		self.width = width
+		self.height = height
+		self.walls = walls
+		self.index = [-1] * (width * height)
+		self.cells = []
+		for i, wall in enumerate(walls):
+			if not wall:
+				self.index[i] = len(self.cells)
+				self.cells.append(i)
+		self.bits = bytearray(self.estimate_bytes(len(self.cells)))
+		self.ready = False
+		self.cancelled = False
+
+	@staticmethod
+	def estimate_bytes(num_open):
+		return (num_open * (num_open - 1) // 2 + 7) // 8
+
+	def nbytes(self):
+		return len(self.bits)
+
+	def build(self):
+		walls = self.walls
+		width = self.width
+		bits = self.bits
+		coords = [divmod(c, width) for c in self.cells]
+		for j in range(1, len(coords)):
+			if self.cancelled:
+				return
+			y2, x2 = coords[j]
+			base = j * (j - 1) // 2
+			for i in range(j):
+				y1, x1 = coords[i]
+				if clear_line(walls, width, x1, y1, x2, y2) or clear_line(walls, width, x2, y2, x1, y1):
+					k = base + i
+					bits[k >> 3] |= 1 << (k & 7)
+		self.ready = True
+
+	def start(self):
+		Thread(target=self.build, daemon=True).start()
+
+	def test(self, pos1, pos2):
+		if pos1 == pos2:
+			return True
+		width = self.width
+		height = self.height
+		if not (0 <= pos1.x < width and 0 <= pos1.y < height and 0 <= pos2.x < width and 0 <= pos2.y < height):
+			return False
+		i = self.index[pos1.y * width + pos1.x]
+		j = self.index[pos2.y * width + pos2.x]
+		if i < 0 or j < 0:
+			return False
+		if i > j:
+			i, j = j, i
+		k = j * (j - 1) // 2 + i
+		return (self.bits[k >> 3] >> (k & 7)) & 1 == 1
+
+class LOSCache:
+	#Bounded LRU cache of line-of-sight results. Since line of sight is symmetric, each unordered pair of cells
+	#is stored once, under a single int key. Both positive and negative results are cached.
+	
+	def __init__(self, width, height, max_bytes):
+		self.width = width
+		self.height = height
+		self.max_entries = max(1, max_bytes // _CACHE_ENTRY_BYTES)
+		self.entries = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		
+	def key(self, pos1, pos2):
+		width = self.width
+		i = pos1.y * width + pos1.x
+		j = pos2.y * width + pos2.x
+		if i > j:
+			i, j = j, i
+		return i * width * self.height + j
+		
+	def get(self, key):
+		entries = self.entries
+		val = entries.get(key)
+		if val is None:
+			self.misses += 1
+		else:
+			self.hits += 1
+			entries.move_to_end(key)
+		return val
+		
+	def put(self, key, val):
+		entries = self.entries
+		entries[key] = val
+		if len(entries) > self.max_entries:
+			entries.popitem(last=False)
+			self.evictions += 1
+			
+	def clear(self):
+		self.entries.clear()
+		
+	def __len__(self):
+		return len(self.entries)
+		
+	def nbytes(self):
+		return len(self.entries) * _CACHE_ENTRY_BYTES
+		
+	def stats(self):
+		total = self.hits + self.misses
+		return {
+			"entries": len(self.entries),
+			"hits": self.hits,
+			"misses": self.misses,
+			"evictions": self.evictions,
+			"hit_rate": self.hits / total if total else 0.0
+		}
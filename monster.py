@@ -9,7 +9,7 @@ from json_obj import *
 
 class Monster(Entity):
 	
-	def __init__(self):
+	def __init__(self, rand=random):
 		super().__init__()
 		self.id = "unknown"
 		self.symbol = "m"
@@ -19,12 +19,13 @@ class Monster(Entity):
 		self.patience = 0
 		self.pursue_check = 0
 		self.path = deque()
+		self.path_goal = None
 		self.soundf = 0
 		self.weapon = None
 		self.shield = False
 		self.type = None
 		self.bat_tick = 0
-		self.energy = rng(-100, 50)
+		self.energy = rand.randint(-100, 50)
 		
 	def is_monster(self):
 		return True
@@ -42,8 +43,8 @@ class Monster(Entity):
 		return False
 		
 	@classmethod
-	def from_type(cls, typ):
-		m = cls()
+	def from_type(cls, typ, rand=random):
+		m = cls(rand)
 		m.id = typ.id
 		m.type = typ
 		m.name = typ.name
@@ -99,32 +100,105 @@ class Monster(Entity):
 	def set_state(self, state):
 		self.state = state
 		
-	def calc_path_to(self, pos):
-		g = self.g
-		board = g.get_board()
+	def path_cost(self, p):
+		if (c := self.g.monster_at(p)) and not self.will_attack(c):
+			return OCCUPIED_PATH_COST
+		return 1
 		
-		def cost_func(p):
-			cost = 1
-			if (c := g.monster_at(p)) and not self.will_attack(c):
-				cost += 2
-			
-			return cost
+	def path_budget(self):
+		#How many cells a path search may expand; smarter monsters, and those chasing something, plan further ahead
+		budget = PATH_BUDGET_BASE + self.INT * PATH_BUDGET_PER_INT
+		if not self.is_aware():
+			budget //= 2
+		return budget
 		
-		path = board.get_path(self.pos, pos, cost_func)
+	def calc_path_to(self, pos):
+		board = self.g.get_board()
+		#If the search runs out of budget, this is a partial path that gets us closer; we search again once we reach its end
+		if self.has_status("Confused"):
+			#We'd attack any monster in the way, so every step costs the same and jump point search can be used
+			path = board.get_path(self.pos, pos, max_expansions=self.path_budget(), jps=True)
+		else:
+			path = board.shared_path(self.pos, pos, self.path_budget())
 		
+		self.path_goal = pos.copy()
 		self.path.clear()
 		if not path:
 			return
 		del path[0] #Remove start position		
 		self.path.extend(path)
 		
+	def repair_path(self, pos):
+		#Patch up the cached path for the two common changes while chasing something, so that path_towards
+		#doesn't have to search from scratch: the target moving by a step, and someone standing on our next step
+		g = self.g
+		board = g.get_board()
+		path = self.path
+		if self.distance(path[0]) > 1:
+			return
+		
+		if pos != self.path_goal:
+			#Partial paths don't end at the goal, so there's nothing to patch
+			if path[-1] != self.path_goal:
+				return
+			if pos in path:
+				while path[-1] != pos:
+					path.pop()
+			elif path[-1].distance(pos) == 1 and board.passable(pos):
+				path.append(pos.copy())
+			else:
+				return
+			self.path_goal = pos.copy()
+		
+		if path[0] == pos or not g.entity_at(path[0]):
+			return
+		#Find a way around to a free cell a few steps further along, treating other occupied cells as very costly
+		k = 1
+		while k < len(path) - 1 and (k < PATH_REPAIR_LOOKAHEAD or g.entity_at(path[k])):
+			k += 1
+		if k >= len(path) or g.entity_at(path[k]) and path[k] != pos:
+			return
+		def cost_func(p):
+			return 10 if g.entity_at(p) and p != pos else self.path_cost(p)
+		detour = board.get_path(self.pos, path[k], cost_func, PATH_REPAIR_MAX_EXPANSIONS)
+		if len(detour) < 2 or detour[-1] != path[k] or g.entity_at(detour[1]):
+			return
+		for _ in range(k + 1):
+			path.popleft()
+		detour.reverse()
+		detour.pop() #Remove start position
+		path.extendleft(detour)
+		
+	def step_downhill(self, pos):
+		#Take one step along the board's shared distance map toward pos. The map only grows as far as our path budget,
+		#so if we're further away than that, we return False and path_towards falls back to a budgeted search.
+		board = self.g.get_board()
+		approach = board.approach_map(pos)
+		budget = self.path_budget()
+		here = approach.distance(self.pos, budget)
+		if here is None:
+			return False
+		steps = [p for p in board.get_adjacent_tiles(self.pos) if approach.distance(p, budget) == here - 1]
+		self.g.ai_rng.shuffle(steps)
+		for p in steps:
+			if self.move_to(p):
+				self.path.clear()
+				self.use_move_energy()
+				return True
+		return False
+
 	def path_towards(self, pos):
 		if self.pos == pos:
 			self.path.clear()
 			return True
-		
+
+		#Everyone chasing the player shares one distance map; if the way downhill is blocked, fall back to our own path
+		if pos == self.g.get_player().pos and self.step_downhill(pos):
+			return True
+
 		if self.path:
-			can_path = pos == self.path[-1] and self.distance(self.path[0]) <= 1
+			self.repair_path(pos)
+			can_path = pos == self.path_goal and self.distance(self.path[0]) <= 1
 			
 			if not (can_path and self.move_to(self.path.popleft())):
 				#Either target tile changed, path is blocked, or we're off-course; recalculate path
@@ -178,7 +252,7 @@ class Monster(Entity):
 		
 		if self.state in ["IDLE", "TRACKING"]:
 			dist_to_player = noise.pos.distance(player.pos)
-			if seen and in_player_fov and dist_to_player < rng(1, 10):
+			if seen and in_player_fov and dist_to_player < self.g.ai_rng.randint(1, 10):
 				self.alerted() 
 			elif self.soundf < duration:
 				self.state = "TRACKING_SOUND"
@@ -189,7 +263,7 @@ class Monster(Entity):
 		return super().get_perception() + self.get_skill("perception")
 				
 	def check_alerted(self):
-		if one_in(70):
+		if one_in(70, self.g.ai_rng):
 			return True
 		#Player's stealth check against monster's passive perception
 		g = self.g
@@ -212,7 +286,7 @@ class Monster(Entity):
 		
 		if stealth_roll < perception:
 			margin = perception - stealth_roll
-			return x_in_y(1, min(dist, 7) - margin)	
+			return x_in_y(1, min(dist, 7) - margin, g.ai_rng)	
 		return False
 		
 	def tick(self):
@@ -282,7 +356,7 @@ class Monster(Entity):
 		board = g.get_board()
 		
 		adj = board.get_adjacent_tiles(self.pos)	
-		random.shuffle(adj)
+		g.ai_rng.shuffle(adj)
 		
 		for pos in adj:
 			if self.can_move_to(pos):
@@ -317,7 +391,7 @@ class Monster(Entity):
 		has_los = self.sees_pos(target)
 				
 		d = abs(delta)			
-		move_x = x_in_y(d.x, d.x + d.y) #Randomize, weighted by the x and y difference to the target
+		move_x = x_in_y(d.x, d.x + d.y, g.ai_rng) #Randomize, weighted by the x and y difference to the target
 		if move_x:
 			t = Point(pos.x + dx, pos.y)
 		else:
@@ -384,7 +458,7 @@ class Monster(Entity):
 		
 		
 		if (c := g.entity_at(target)) and self.will_attack(c):
-			if self.can_reach_attack(target) and ((x_in_y(3, dist + 2) or one_in(3))):
+			if self.can_reach_attack(target) and ((x_in_y(3, dist + 2, g.ai_rng) or one_in(3, g.ai_rng))):
 				if self.attack_pos(target):
 					return
 				
@@ -472,7 +546,7 @@ class Monster(Entity):
 				
 	def move_dir(self, dx, dy):	
 		g = self.g
-		newpos = Point(self.x+dx, self.y+dy)
+		newpos = Point(self.pos.x+dx, self.pos.y+dy)
 		if super().move_dir(dx, dy):
 			self.use_move_energy()
 			return True
@@ -722,7 +796,7 @@ class Monster(Entity):
 		chance = 1
 		target = None
 		for pos in board.points_in_radius(self.pos, 3):
-			if self.has_clear_path_to(pos) and one_in(chance):
+			if self.has_clear_path_to(pos) and one_in(chance, g.ai_rng):
 				chance += 1
 				target = pos
 		if target:
@@ -733,7 +807,7 @@ class Monster(Entity):
 		player = g.get_player()
 		
 		dist = self.distance(c)
-		if dist <= 1 and one_in(4):
+		if dist <= 1 and one_in(4, g.ai_rng):
 			return True
 			
 		return self.perception_roll() >= player.stealth_roll()
@@ -748,7 +822,7 @@ class Monster(Entity):
 		g = self.g
 		
 		if self.has_flag("PACK_TRAVEL"):
-			for mon in g.monsters_in_radius(self.pos, rng(8, 16)):
+			for mon in g.monsters_in_radius(self.pos, g.ai_rng.randint(8, 16)):
 				if self is mon:
 					continue
 				if not self.is_ally(mon):
@@ -790,7 +864,7 @@ class Monster(Entity):
 							cands.append(pos)
 							
 					if cands:
-						g.spawn_monster_at(clone, random.choice(cands))
+						g.spawn_monster_at(clone, g.ai_rng.choice(cands))
 						player = g.get_player()			
 						if player.sees(self) or player.sees(clone):
 							player.add_msg(f"{self.get_name(True)} splits into two!", "warning")
@@ -815,12 +889,12 @@ class Monster(Entity):
 						self.target_entity(player)
 						
 					if self.id == "bat":
-						if self.bat_tick > 0 or one_in(6):
+						if self.bat_tick > 0 or one_in(6, g.ai_rng):
 							if self.bat_tick > 0:
 								self.bat_tick -= 1	
 							self.set_rand_target()
-						elif one_in(15):
-							self.bat_tick = rng(2, 5)	
+						elif one_in(15, g.ai_rng):
+							self.bat_tick = g.ai_rng.randint(2, 5)	
 				elif self.sees_pos(player.pos): 
 					#Target is in LOS, but invisible
 					perceived_invis = self.determine_invis(player)
@@ -835,7 +909,7 @@ class Monster(Entity):
 					self.target_entity(player)
 					self.pursue_check = 0
 					patience = self.base_pursue_duration()	
-					self.patience = round(patience * random.triangular(0.8, 1.2))
+					self.patience = round(patience * g.ai_rng.triangular(0.8, 1.2))
 				
 			case "TRACKING":
 				if self.pursue_check > 0:
@@ -849,10 +923,10 @@ class Monster(Entity):
 						self.set_target(player.pos)
 						self.bat_tick = 0
 					elif self.has_flag("PACK_TRAVEL") and self.set_pack_target_pos():
-						self.patience += rng(0, 1)
+						self.patience += g.ai_rng.randint(0, 1)
 					else:
 						#If we fail, idle around for a few turns instead
-						self.pursue_check = rng(1, 4)
+						self.pursue_check = g.ai_rng.randint(1, 4)
 						self.idle()
 						
 		
@@ -866,13 +940,13 @@ class Monster(Entity):
 					self.soundf -= 1
 				
 				stealth_val = 10 + player.stealth_mod()
-				if self.sees(player) and one_in(2) and self.perception_roll() >= stealth_val:
+				if self.sees(player) and one_in(2, g.ai_rng) and self.perception_roll() >= stealth_val:
 					self.set_state("AWARE")
 					self.alerted()
 				elif self.soundf <= 0:
 					self.set_state("IDLE")
 		
-		if self.has_status("Confused") and not one_in(4):
+		if self.has_status("Confused") and not one_in(4, g.ai_rng):
 			self.set_rand_target()
 			
 		
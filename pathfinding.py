@@ -1,88 +1,86 @@
-from collections import defaultdict
+import heapq
 import random
+import threading
 from utils import Point
 
-class OpenSet:
-	
-	def __init__(self, key=None):
-		self._data = []
-		self._dup = set()
-		self.key = key or (lambda v: v)
-		
-	def add(self, value):
-		if value in self._dup:
-			return
-		self._dup.add(value)
-		a = self._data
-		key = self.key
-		i = len(a)
-		a.append(value)
-		while i > 0:
-			parent = i // 2
-			if key(a[parent]) < key(a[i]):
-				break
-			a[parent], a[i] = a[i], a[parent]
-			i = parent
-			
-	def pop(self):
-		if len(self._data) == 0:
-			raise IndexError("pop from an empty heap")
-		a = self._data
-		val = a[0]
-		a[0] = a[-1]
-		a.pop()
-		key = self.key
-		i = 0
-		while True:
-			left = 2 * i + 1
-			right = 2 * i + 2
-			if left >= len(a):
-				break
-			node = left
-			if right < len(a) and key(a[right]) < key(a[left]):
-				node = right
-			if key(a[i]) > key(a[node]):
-				a[i], a[node] = a[node], a[i]
-				i = node
-			else:
-				break
-		self._dup.remove(val)
-		return val
-		
-	def __contains__(self, value):
-		return value in self._dup
-		
-	def __bool__(self):
-		return len(self._data) > 0
-		
+INF = float("inf")
+
+_scratch = threading.local()
+
 def h(p1, p2):
 	delta = p1 - p2
 	return abs(delta.x) + abs(delta.y)
-	
-def reconstruct_path(came_from, curr):
-	path = [curr]
-	while curr in came_from:
+
+def reconstruct_path(came_from, curr, width):
+	path = []
+	while curr != -1:
+		y, x = divmod(curr, width)
+		path.append(Point(x, y))
 		curr = came_from[curr]
-		path.append(curr)
 	path.reverse()
 	return path
-		
-def find_path(board, start, end, passable_func, cost_func):
-	gScore = defaultdict(lambda: float("inf"))
-	gScore[start] = 0
-	fScore = defaultdict(lambda: float("inf"))
-	fScore[start] = h(start, end)
-	open_set = OpenSet(fScore.__getitem__)
-	open_set.add(start)
-	came_from = {}
+
+def find_path(board, start, end, passable_func, cost_func, max_expansions=None, costs=None):
+	return search_path(board, start, end, passable_func, cost_func, max_expansions, costs)[0]
+
+def search_path(board, start, end, passable_func, cost_func, max_expansions=None, costs=None):
+	#A* over cell indices (y*width+x). The open set is a heap of (f, h, index) entries; rather than updating entries in place,
+	#a cell whose score improves is pushed again, and entries that no longer match the cell's score are skipped when popped.
+	#Returns (path, number of cells expanded). If max_expansions runs out first, the path leads to the expanded cell closest to the goal.
+	#If costs is given, it's an array of the cost of entering each cell (0 for impassable), used instead of passable_func and cost_func.
+	#Ties between neighbors are broken at random, drawing from board.path_rng if it's set (the game's AI stream).
 	width = board.width
-	height = board.height	
-	while open_set:
-		curr = open_set.pop()
-		if curr == end:
-			return reconstruct_path(came_from, curr)
+	height = board.height
+	start_index = start.y * width + start.x
+	end_index = end.y * width + end.x
+
+	shuffle = (board.path_rng or random).shuffle
+	g_score, came_from = _get_scratch(width * height)
+	touched = [start_index]
+	try:
+		if costs is not None:
+			return _search_costs(width, height, start, end, start_index, end_index, g_score, came_from, touched, costs, max_expansions, shuffle)
+		return _search(width, height, start, end, start_index, end_index, g_score, came_from, touched, passable_func, cost_func, max_expansions, shuffle)
+	finally:
+		#Put the scratch arrays back the way we found them, touching only the cells this search reached
+		for index in touched:
+			g_score[index] = INF
+			came_from[index] = -1
+
+def _get_scratch(size):
+	#Score arrays are reused between searches (one pair per thread) so that a short search on a big board doesn't pay to allocate them
+	arrays = getattr(_scratch, "arrays", None)
+	if arrays is None:
+		arrays = _scratch.arrays = {}
+	if (scratch := arrays.get(size)) is None:
+		scratch = arrays[size] = ([INF] * size, [-1] * size)
+	return scratch
+
+def _search(width, height, start, end, start_index, end_index, g_score, came_from, touched, passable_func, cost_func, max_expansions, shuffle):
+	gx = end.x
+	gy = end.y
+	g_score[start_index] = 0
+	start_h = abs(start.x - gx) + abs(start.y - gy)
+	open_heap = [(start_h, start_h, start_index)]
+	heappush = heapq.heappush
+	heappop = heapq.heappop
+	expansions = 0
+	best = (start_h, 0, start_index)
+
+	while open_heap:
+		f, ch, curr = heappop(open_heap)
+		g = g_score[curr]
+		if f != g + ch:
+			continue
+		if curr == end_index:
+			return reconstruct_path(came_from, curr, width), expansions
+		if max_expansions is not None and expansions >= max_expansions:
+			return reconstruct_path(came_from, best[2], width), expansions
+		expansions += 1
+		if (ch, g) < best[:2]:
+			best = (ch, g, curr)
+		y, x = divmod(curr, width)
 		neighbors = []
-		x, y = curr.as_tuple()
 		if x > 0 and passable_func((c := Point(x - 1, y))):
 			neighbors.append(c)
 		if x < width - 1 and passable_func((c := Point(x + 1, y))):
@@ -90,15 +88,210 @@ def find_path(board, start, end, passable_func, cost_func):
 		if y > 0 and passable_func((c := Point(x, y - 1))):
 			neighbors.append(c)
 		if y < height - 1 and passable_func((c := Point(x, y + 1))):
-			neighbors.append(c)	
-		random.shuffle(neighbors)		
+			neighbors.append(c)
+		shuffle(neighbors)
 		for n in neighbors:
-			t = gScore[curr] + cost_func(n)
-			if t < gScore[n]:
-				came_from[n] = curr
-				gScore[n] = t
-				fScore[n] = t + h(n, end)
-				if n not in open_set:
-					open_set.add(n)	
-	return []
-		
\ No newline at end of file
+			t = g + cost_func(n)
+			index = n.y * width + n.x
+			if t < g_score[index]:
+				if g_score[index] == INF:
+					touched.append(index)
+				came_from[index] = curr
+				g_score[index] = t
+				nh = abs(n.x - gx) + abs(n.y - gy)
+				heappush(open_heap, (t + nh, nh, index))
+	return [], expansions
+
+def _search_costs(width, height, start, end, start_index, end_index, g_score, came_from, touched, costs, max_expansions, shuffle):
+	#The same search as _search, reading costs straight from the array instead of calling back for each neighbor
+	gx = end.x
+	gy = end.y
+	g_score[start_index] = 0
+	start_h = abs(start.x - gx) + abs(start.y - gy)
+	open_heap = [(start_h, start_h, start_index)]
+	heappush = heapq.heappush
+	heappop = heapq.heappop
+	expansions = 0
+	best = (start_h, 0, start_index)
+	last_x = width - 1
+	last_y = height - 1
+
+	while open_heap:
+		f, ch, curr = heappop(open_heap)
+		g = g_score[curr]
+		if f != g + ch:
+			continue
+		if curr == end_index:
+			return reconstruct_path(came_from, curr, width), expansions
+		if max_expansions is not None and expansions >= max_expansions:
+			return reconstruct_path(came_from, best[2], width), expansions
+		expansions += 1
+		if (ch, g) < best[:2]:
+			best = (ch, g, curr)
+		y, x = divmod(curr, width)
+		neighbors = []
+		if x > 0 and costs[curr - 1]:
+			neighbors.append(curr - 1)
+		if x < last_x and costs[curr + 1]:
+			neighbors.append(curr + 1)
+		if y > 0 and costs[curr - width]:
+			neighbors.append(curr - width)
+		if y < last_y and costs[curr + width]:
+			neighbors.append(curr + width)
+		shuffle(neighbors)
+		for index in neighbors:
+			t = g + costs[index]
+			if t < g_score[index]:
+				if g_score[index] == INF:
+					touched.append(index)
+				came_from[index] = curr
+				g_score[index] = t
+				ny, nx = divmod(index, width)
+				nh = abs(nx - gx) + abs(ny - gy)
+				heappush(open_heap, (t + nh, nh, index))
+	return [], expansions
+
+def search_path_jps(board, start, end, max_expansions=None):
+	#Jump point search for 4-connected grids where every step costs 1, using only the walls.
+	#From each node, the search scans in straight lines and only adds the cells where a turn might be needed (jump points),
+	#so open ground is crossed without pushing every cell onto the heap. A vertical scan also looks sideways at every step,
+	#and stops wherever a horizontal scan would find a jump point. Returns (path, number of jump points expanded).
+	#Scans work on cell indices and rely on the wall around the edge of every level to stop them.
+	width = board.width
+	walls = board.walls
+	gx = end.x
+	gy = end.y
+	end_index = gy * width + gx
+
+	def jump_x(i, dx):
+		while True:
+			i += dx
+			if walls[i]:
+				return -1
+			if i == end_index:
+				return i
+			up = i - width
+			down = i + width
+			if (not walls[up] and walls[up - dx]) or (not walls[down] and walls[down - dx]):
+				return i
+
+	def jump_y(i, dy):
+		step = dy * width
+		while True:
+			i += step
+			if walls[i]:
+				return -1
+			if i == end_index:
+				return i
+			back = i - step
+			if (not walls[i - 1] and walls[back - 1]) or (not walls[i + 1] and walls[back + 1]):
+				return i
+			if jump_x(i, 1) != -1 or jump_x(i, -1) != -1:
+				return i
+
+	start_index = start.y * width + start.x
+	start_h = abs(start.x - gx) + abs(start.y - gy)
+	g_score = {start_index: 0}
+	came_from = {start_index: -1}
+	open_heap = [(start_h, start_h, start_index)]
+	heappush = heapq.heappush
+	heappop = heapq.heappop
+	expansions = 0
+	best = (start_h, 0, start_index)
+
+	while open_heap:
+		f, ch, curr = heappop(open_heap)
+		g = g_score[curr]
+		if f != g + ch:
+			continue
+		if curr == end_index:
+			return _expand_jumps(came_from, curr, width), expansions
+		if max_expansions is not None and expansions >= max_expansions:
+			return _expand_jumps(came_from, best[2], width), expansions
+		expansions += 1
+		if (ch, g) < best[:2]:
+			best = (ch, g, curr)
+		y, x = divmod(curr, width)
+		parent = came_from[curr]
+		if parent == -1:
+			jumps = (jump_x(curr, 1), jump_x(curr, -1), jump_y(curr, 1), jump_y(curr, -1))
+		else:
+			py, px = divmod(parent, width)
+			if px != x:
+				dx = 1 if x > px else -1
+				jumps = (jump_x(curr, dx), jump_y(curr, 1), jump_y(curr, -1))
+			else:
+				dy = 1 if y > py else -1
+				jumps = (jump_y(curr, dy), jump_x(curr, 1), jump_x(curr, -1))
+		for index in jumps:
+			if index == -1:
+				continue
+			ny, nx = divmod(index, width)
+			t = g + abs(nx - x) + abs(ny - y)
+			if t < g_score.get(index, INF):
+				g_score[index] = t
+				came_from[index] = curr
+				nh = abs(nx - gx) + abs(ny - gy)
+				heappush(open_heap, (t + nh, nh, index))
+	return [], expansions
+
+def _expand_jumps(came_from, curr, width):
+	#Fill in the straight lines between consecutive jump points
+	jumps = []
+	while curr != -1:
+		jumps.append(curr)
+		curr = came_from[curr]
+	jumps.reverse()
+	y, x = divmod(jumps[0], width)
+	path = [Point(x, y)]
+	for index in jumps[1:]:
+		ny, nx = divmod(index, width)
+		dx = (nx > x) - (nx < x)
+		dy = (ny > y) - (ny < y)
+		while x != nx or y != ny:
+			x += dx
+			y += dy
+			path.append(Point(x, y))
+	return path
+
+class ApproachMap:
+	#Walking distances from every cell to a shared goal, so that any number of monsters heading there can just step downhill.
+	#The breadth-first search only expands as far out as it has been asked about, one ring of distances at a time.
+
+	def __init__(self, board, goal):
+		self.width = board.width
+		self.height = board.height
+		self.walls = board.walls
+		self.components = board.components
+		goal_index = goal.y * self.width + goal.x
+		self.label = self.components[goal_index]
+		self.dist = {goal_index: 0}
+		self.frontier = [goal_index]
+		self.depth = 0
+
+	def _expand(self):
+		width = self.width
+		height = self.height
+		walls = self.walls
+		dist = self.dist
+		depth = self.depth + 1
+		frontier = []
+		for curr in self.frontier:
+			y, x = divmod(curr, width)
+			for n, ok in ((curr - 1, x > 0), (curr + 1, x < width - 1), (curr - width, y > 0), (curr + width, y < height - 1)):
+				if ok and not walls[n] and n not in dist:
+					dist[n] = depth
+					frontier.append(n)
+		self.frontier = frontier
+		self.depth = depth
+
+	def distance(self, pos, max_cells=None):
+		#Number of steps from pos to the goal, or None if it can't be reached. If max_cells is given, the search stops growing
+		#once it has visited that many cells, and returns None for pos if it hasn't got there by then.
+		index = pos.y * self.width + pos.x
+		if self.label and self.components[index] != self.label:
+			return None
+		dist = self.dist
+		while index not in dist and self.frontier and (max_cells is None or len(dist) < max_cells):
+			self._expand()
+		return dist.get(index)
@@ -7,6 +7,7 @@ import math
 
 from activity import *
 from projectile import Projectile
+from fov import FOVMask
 
 class Player(Entity):
 	
@@ -23,7 +24,7 @@ class Player(Entity):
 		self.xp = 0
 		self.xp_level = 1
 		self.regen_tick = 0
-		self.fov = set()
+		self.fov = FOVMask(0, 0)
 		self.energy_used = 0
 		self.is_resting = False
 		self.debug_wizard = False
@@ -1,141 +1,207 @@
 import random
-from copy import deepcopy
 from utils import *
 from pathfinding import find_path
 
-def count_neighbors(grid, x, y):
-	w = len(grid[0])
-	h = len(grid)
-	num = 0
-	if x > 0:
-		num += grid[y][x-1]	
-	if x < w - 1:
-		num += grid[y][x+1]
-	if y > 0:
-		num += grid[y-1][x]
-	if y < h - 1:
-		num += grid[y+1][x]
-	
-	if x > 0 and y > 0:
-		num += grid[y-1][x-1]
-	if x > 0 and y < h - 1:
-		num += grid[y+1][x-1]	
-	if x < w - 1 and y > 0:
-		num += grid[y-1][x+1]	
-	if x < w - 1 and y < h - 1:
-		num += grid[y+1][x+1]	
-	
-	return num
+try:
+	import numpy as np
+except ImportError:
+	np = None
 	
-def flood_fill(grid, x, y, pred):
-	visited = set()
-	stack = [(x, y)]
-	w = len(grid[0])
-	h = len(grid)
-	
-	while stack:
-		pos = stack.pop()
-		if pos in visited:
-			continue
-		visited.add(pos)
-		xp, yp = pos
-		if grid[yp][xp] == 0:
-			
-			pred(xp, yp)
-			if xp > 0:
-				stack.append((xp-1, yp))
-			if xp < w - 1:
-				stack.append((xp+1, yp))
-			if yp > 0:
-				stack.append((xp, yp-1))
-			if yp < h - 1:
-				stack.append((xp, yp+1))
-				
 def cellular_automata_pass(grid):
+	#A wall with fewer than 3 walls among its 8 neighbors opens up, and an open cell with more than 4 becomes a wall.
+	#Cells outside the grid count as open. Neighbor counts come from the sums of each column of three, so each row takes one sweep.
 	w = len(grid[0])
 	h = len(grid)
-	c = deepcopy(grid)
+	old = grid.copy()
+	empty = [0] * w
 	for y in range(h):
-		for x in range(w):
-			num = count_neighbors(c, x, y) 
-			if c[y][x] == 1:
-				if num < 3:
-					grid[y][x] = 0
-			elif c[y][x] == 0:
-				if num > 4:
-					grid[y][x] = 1
+		above = old[y-1] if y > 0 else empty
+		below = old[y+1] if y < h - 1 else empty
+		row = old[y]
+		cols = [0]
+		cols.extend(map(sum, zip(above, row, below)))
+		cols.append(0)
+		grid[y] = [
+			(total - cell >= 3 if cell else total > 4) * 1
+			for cell, total in zip(row, map(sum, zip(cols, cols[1:], cols[2:])))
+		]
+
+def cellular_automata(grid, iters):
+	if np is None:
+		for _ in range(iters):
+			cellular_automata_pass(grid)
+		return
+	#Same rules as cellular_automata_pass, with each pass's neighbor counts summed from 8 shifted copies of the grid
+	cells = np.array(grid, dtype=np.uint8)
+	for _ in range(iters):
+		p = np.pad(cells, 1)
+		num = p[:-2, :-2] + p[:-2, 1:-1] + p[:-2, 2:] + p[1:-1, :-2] + p[1:-1, 2:] + p[2:, :-2] + p[2:, 1:-1] + p[2:, 2:]
+		cells = np.where(cells == 1, num >= 3, num > 4).astype(np.uint8)
+	grid[:] = cells.tolist()
 					
-def find_disconnected_zones(grid):
-	w = len(grid[0])
-	h = len(grid)
+def zone_runs(grid):
+	#Connected regions of open cells (4-connected), each as a list of (y, x1, x2) runs of open cells, in the order their first cells appear.
+	#Each row is split into runs of open cells, and runs that overlap a run in the row above are merged with union-find.
+	parent = []
 	
-	empty = set()
-						
-	for y in range(h):
-		for x in range(w):
-			if grid[y][x] == 0:
-				empty.add((x, y))
+	def find(a):
+		while parent[a] != a:
+			parent[a] = parent[parent[a]]
+			a = parent[a]
+		return a
+		
+	runs = []
+	prev = []
+	for y, row in enumerate(grid):
+		cells = bytes(row)
+		w = len(cells)
+		curr = []
+		j = 0
+		x = cells.find(0)
+		while x != -1:
+			end = cells.find(1, x)
+			if end == -1:
+				end = w
+			label = len(parent)
+			parent.append(label)
+			#Runs in the previous row that overlap this one; they're sorted, so pick up where the last run left off
+			while j < len(prev) and prev[j][1] <= x:
+				j += 1
+			k = j
+			while k < len(prev) and prev[k][0] < end:
+				a = find(prev[k][2])
+				b = find(label)
+				if a != b:
+					parent[max(a, b)] = min(a, b)
+				k += 1
+			curr.append((x, end, label))
+			runs.append((y, x, end, label))
+			x = cells.find(0, end) if end < w else -1
+		prev = curr
+		
+	zones = {}
+	for y, x1, x2, label in runs:
+		zones.setdefault(find(label), []).append((y, x1, x2))
+	return list(zones.values())
 	
-	curr = []
+def find_disconnected_zones(grid):
+	#The same zones as lists of board positions (grid cells are offset by 1 from the board, since the grid leaves out the border)
 	zones = []
-				
-	def func(xp, yp):
-		curr.append(Point(xp+1, yp+1))
-		empty.discard((xp, yp))
-				
+	for runs in zone_runs(grid):
+		zones.append([Point(x + 1, y + 1) for y, x1, x2 in runs for x in range(x1, x2)])
+	return zones
 	
-	while empty:
-		x, y = empty.pop()	
-		curr = []
-		flood_fill(grid, x, y, func)
-		zones.append(curr)
+def zone_centroid(zone):
+	return (sum(p.x for p in zone) / len(zone), sum(p.y for p in zone) / len(zone))
 	
-	return zones
+def spanning_tree(points):
+	#Edges (i, j) of a minimum spanning tree over the points, by straight-line distance (Prim's algorithm)
+	n = len(points)
+	if np is not None:
+		coords = np.array(points, dtype=float)
+		best = np.full(n, np.inf)
+		link = np.zeros(n, dtype=int)
+		in_tree = np.zeros(n, dtype=bool)
+		curr = 0
+		edges = []
+		for _ in range(n - 1):
+			in_tree[curr] = True
+			dist = ((coords - coords[curr]) ** 2).sum(axis=1)
+			closer = ~in_tree & (dist < best)
+			best[closer] = dist[closer]
+			link[closer] = curr
+			best[in_tree] = np.inf
+			curr = int(best.argmin())
+			edges.append((int(link[curr]), curr))
+		return edges
+	best = [float("inf")] * n
+	link = [0] * n
+	remaining = set(range(1, n))
+	curr = 0
+	edges = []
+	while remaining:
+		cx, cy = points[curr]
+		for i in remaining:
+			x, y = points[i]
+			dist = (x - cx) ** 2 + (y - cy) ** 2
+			if dist < best[i]:
+				best[i] = dist
+				link[i] = curr
+		curr = min(remaining, key=best.__getitem__)
+		remaining.remove(curr)
+		edges.append((link[curr], curr))
+	return edges
 	
-def procgen(board):
+def nearest_in_zone(zone, x, y):
+	return min(zone, key=lambda p: abs(p.x - x) + abs(p.y - y))
+	
+def carve_corridor(board, p1, p2, rand=random):
+	#An L-shaped corridor between two points, turning at a random corner. Returns its length: the number of walls dug out
+	if rand.randint(1, 2) == 1:
+		corner = Point(p2.x, p1.y)
+	else:
+		corner = Point(p1.x, p2.y)
+	dug = 0
+	for a, b in ((p1, corner), (corner, p2)):
+		for x in range(min(a.x, b.x), max(a.x, b.x) + 1):
+			for y in range(min(a.y, b.y), max(a.y, b.y) + 1):
+				if board.walls[y * board.width + x]:
+					board.set_wall(x, y, False)
+					dug += 1
+	return dug
+	
+def procgen(board, rand=random):
+	#rand is the source of random numbers (the random module by default), so a level can be generated from its own seeded
+	#random.Random without touching the global state, for example in a background thread.
+	#Returns the number of zones the cellular automata left, and the lengths of the corridors dug to join them.
 	width = board.width
 	height = board.height
-	grid = [[0 for i in range(width-2)] for j in range(height-2)]
 	
-	#Initialize the base randomly
-	p = random.triangular(45, 55)
-	for y in range(height-2):
-		for x in range(width-2):
-			if x_in_y(p, 100):
-				grid[y][x] = 1	
+	#Initialize the base randomly. This draws the same random numbers, in the same order, as calling x_in_y(p, 100) for each cell
+	p = rand.triangular(45, 55)
+	roll = rand.random
+	grid = [[(100.0 * roll() < p) * 1 for x in range(width-2)] for y in range(height-2)]
 	
-	iters = rng(3, 4) + rng(0, 4)
-	for _ in range(iters):
-		cellular_automata_pass(grid)
+	iters = rand.randint(3, 4) + rand.randint(0, 4)
+	cellular_automata(grid, iters)
 						
 	zones = find_disconnected_zones(grid)
 	
-	for pos in board.iter_square(1, 1, width-2, height-2):
-		tile = board.get_tile(pos)
-		x, y = pos.as_tuple()
-		tile.wall = bool(grid[pos.y-1][pos.x-1])
+	for y in range(1, height-1):
+		board.set_wall_row(1, y, grid[y-1])
 			
 	assert len(zones) > 0
+	corridors = []
 	if len(zones) <= 1:
-		return
+		return len(zones), corridors
 		
-	def passable_func(pos):
-		return (1 <= pos.x < board.width - 1) and (1 <= pos.y < board.height - 1)
-	
-	cost_func = lambda pos: 0.5 if board.get_tile(pos).wall else 1
+	#Join the zones along a minimum spanning tree of their centroids, plus one extra corridor from the last zone to a random one
+	#so the level isn't always a tree. Each corridor runs between the closest cells of the two zones.
+	centroids = [zone_centroid(zone) for zone in zones]
+	edges = spanning_tree(centroids)
+	edges.append((len(zones) - 1, rand.randint(0, len(zones) - 1)))
+	for i, j in edges:
+		if i == j:
+			continue
+		p2 = nearest_in_zone(zones[j], *centroids[i])
+		p1 = nearest_in_zone(zones[i], p2.x, p2.y)
+		corridors.append(carve_corridor(board, p1, p2, rand))
 		
-	for i in range(len(zones)):
-		p1 = random.choice(zones[i])
-		if i < len(zones) - 1:
-			p2 = random.choice(zones[i + 1])
-		else:
-			zone = zones[rng(0, len(zones)-1)]
-			p2 = random.choice(zone)	
-		path = find_path(board, p1, p2, passable_func, cost_func)
+	#The corridors stay inside the border, so this shouldn't happen; but if some zone is somehow still cut off, dig a path to it
+	interior = [board.walls[y * width + 1:(y + 1) * width - 1] for y in range(1, height - 1)]
+	if len(zone_runs(interior)) > 1:
+		remaining = find_disconnected_zones(interior)
+		def passable_func(pos):
+			return (1 <= pos.x < board.width - 1) and (1 <= pos.y < board.height - 1)
 		
-		for pos in path:
-			tile = board.get_tile(pos)
-			tile.wall = False
-			
-	
-		
\ No newline at end of file
+		cost_func = lambda pos: 1 if board.passable(pos) else 0.5
+		#The search breaks ties with board.path_rng, so point it at rand while digging; otherwise it would use the global module
+		path_rng, board.path_rng = board.path_rng, rand
+		for i in range(1, len(remaining)):
+			path = find_path(board, rand.choice(remaining[i - 1]), rand.choice(remaining[i]), passable_func, cost_func)
+			dug = [pos for pos in path if not board.passable(pos)]
+			for pos in dug:
+				board.set_wall(pos.x, pos.y, False)
+			corridors.append(len(dug))
+		board.path_rng = path_rng
+	return len(zones), corridors
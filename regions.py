@@ -0,0 +1,206 @@
+import heapq
+from pathfinding import search_path
+from utils import Point
+
+class RegionGraph:
+	#Abstract graph for hierarchical pathfinding (HPA*). The board is split into square clusters of size x size cells.
+	#Wherever open cells on both sides of the line between two clusters form a run, the middle of the run is an entrance:
+	#a pair of linked nodes, one on each side. Within a cluster, nodes are joined by their walking distance inside it.
+	#Long paths are found by searching this much smaller graph, then filling in each leg with a short A* search.
+	#Everything is computed per cluster on first use, and only the clusters around a changed tile are thrown away.
+
+	def __init__(self, board, size):
+		self.board = board
+		self.width = board.width
+		self.height = board.height
+		self.size = size
+		self.clusters_x = (self.width + size - 1) // size
+		self.clusters_y = (self.height + size - 1) // size
+		self.borders = {}
+		self.clusters = {}
+
+	def cluster_of(self, index):
+		y, x = divmod(index, self.width)
+		return (y // self.size) * self.clusters_x + x // self.size
+
+	def _bounds(self, c):
+		cy, cx = divmod(c, self.clusters_x)
+		size = self.size
+		return cx * size, cy * size, min((cx + 1) * size, self.width), min((cy + 1) * size, self.height)
+
+	def _border(self, c1, c2):
+		#Entrances between c1 and the cluster to its right or below it, as (cell in c1, cell in c2) pairs
+		key = (c1, c2)
+		if (pairs := self.borders.get(key)) is not None:
+			return pairs
+		walls = self.board.walls
+		width = self.width
+		x1, y1, x2, y2 = self._bounds(c1)
+		if c2 == c1 + 1:
+			step = width
+			first = y1 * width + x2 - 1
+			other = 1
+			length = y2 - y1
+		else:
+			step = 1
+			first = (y2 - 1) * width + x1
+			other = width
+			length = x2 - x1
+		pairs = []
+		run = []
+		for i in range(length + 1):
+			cell = first + i * step
+			if i < length and not walls[cell] and not walls[cell + other]:
+				run.append(cell)
+			elif run:
+				mid = run[len(run) // 2]
+				pairs.append((mid, mid + other))
+				run = []
+		self.borders[key] = pairs
+		return pairs
+
+	def _neighbors(self, c):
+		cy, cx = divmod(c, self.clusters_x)
+		if cx > 0:
+			yield c - 1
+		if cx < self.clusters_x - 1:
+			yield c + 1
+		if cy > 0:
+			yield c - self.clusters_x
+		if cy < self.clusters_y - 1:
+			yield c + self.clusters_x
+
+	def _local_distances(self, src, c, targets):
+		#Breadth-first walking distances from src to each of targets, without leaving cluster c
+		walls = self.board.walls
+		width = self.width
+		x1, y1, x2, y2 = self._bounds(c)
+		dist = {src: 0}
+		found = {}
+		frontier = [src]
+		depth = 0
+		remaining = len(targets)
+		while frontier and remaining:
+			next_frontier = []
+			for curr in frontier:
+				if curr in targets:
+					found[curr] = depth
+					remaining -= 1
+				y, x = divmod(curr, width)
+				for n, ok in ((curr - 1, x > x1), (curr + 1, x < x2 - 1), (curr - width, y > y1), (curr + width, y < y2 - 1)):
+					if ok and not walls[n] and n not in dist:
+						dist[n] = depth + 1
+						next_frontier.append(n)
+			frontier = next_frontier
+			depth += 1
+		return found
+
+	def _cluster(self, c):
+		#(links, edges) for cluster c: links maps each node to the nodes it's paired with in neighboring clusters, and edges maps
+		#each node to (other node, distance) for the nodes it can reach, both within c and by crossing into a neighboring cluster
+		if (data := self.clusters.get(c)) is not None:
+			return data
+		links = {}
+		for n in self._neighbors(c):
+			if n > c:
+				for a, b in self._border(c, n):
+					links.setdefault(a, []).append(b)
+			else:
+				for a, b in self._border(n, c):
+					links.setdefault(b, []).append(a)
+		edges = {}
+		for node in links:
+			edges[node] = [(other, d) for other, d in self._local_distances(node, c, links).items() if other != node]
+			edges[node].extend((other, 1) for other in links[node])
+		data = self.clusters[c] = (links, edges)
+		return data
+
+	def invalidate(self, x, y):
+		#A tile changed; forget the borders of its cluster and everything built on them
+		c = (y // self.size) * self.clusters_x + x // self.size
+		for n in self._neighbors(c):
+			self.borders.pop((min(c, n), max(c, n)), None)
+			self.clusters.pop(n, None)
+		self.clusters.pop(c, None)
+
+	def find_path(self, start, end, costs, max_expansions=None):
+		#Returns (path, cells expanded), or None if the graph doesn't help and an ordinary search should be used instead.
+		#With max_expansions, the abstract search and the searches that fill in its legs share the budget; if it runs out,
+		#the path leads as far as the search got, toward the abstract node closest to the goal.
+		width = self.width
+		start_index = start.y * width + start.x
+		end_index = end.y * width + end.x
+		start_cluster = self.cluster_of(start_index)
+		end_cluster = self.cluster_of(end_index)
+		if start_cluster == end_cluster:
+			return None
+
+		start_edges = self._local_distances(start_index, start_cluster, self._cluster(start_cluster)[0]).items()
+		end_dists = self._local_distances(end_index, end_cluster, self._cluster(end_cluster)[0])
+		gx = end.x
+		gy = end.y
+
+		#Search the abstract graph; -1 stands for the goal
+		g_score = {start_index: 0}
+		came_from = {}
+		start_h = abs(start.x - gx) + abs(start.y - gy)
+		heap = [(start_h, start_h, start_index)]
+		expansions = 0
+		best = (start_h, 0, start_index)
+		while heap:
+			f, heuristic, node = heapq.heappop(heap)
+			g = g_score[node]
+			if f != g + heuristic:
+				continue
+			if node == -1:
+				break
+			if max_expansions is not None and expansions >= max_expansions:
+				break
+			expansions += 1
+			if (heuristic, g) < best[:2]:
+				best = (heuristic, g, node)
+			if node == start_index:
+				options = list(start_edges)
+			else:
+				options = self._cluster(self.cluster_of(node))[1].get(node, [])
+			if node in end_dists:
+				options = options + [(-1, end_dists[node])]
+			for other, cost in options:
+				t = g + cost
+				if t < g_score.get(other, t + 1):
+					g_score[other] = t
+					came_from[other] = node
+					if other == -1:
+						heuristic = 0
+					else:
+						oy, ox = divmod(other, width)
+						heuristic = abs(ox - gx) + abs(oy - gy)
+					heapq.heappush(heap, (t + heuristic, heuristic, other))
+		if -1 in came_from:
+			waypoints = [end_index]
+			node = came_from[-1]
+		elif max_expansions is not None and expansions >= max_expansions:
+			waypoints = []
+			node = best[2]
+		else:
+			return None
+		while node != start_index:
+			waypoints.append(node)
+			node = came_from[node]
+		waypoints.append(start_index)
+		waypoints.reverse()
+
+		#Refine each leg with a short search that also takes the current costs (such as occupied cells) into account
+		path = [start]
+		for a, b in zip(waypoints, waypoints[1:]):
+			ay, ax = divmod(a, width)
+			by, bx = divmod(b, width)
+			budget = None if max_expansions is None else max(0, max_expansions - expansions)
+			leg, leg_expansions = search_path(self.board, Point(ax, ay), Point(bx, by), None, None, budget, costs)
+			if not leg:
+				return None
+			expansions += leg_expansions
+			path.extend(leg[1:])
+			if leg[-1] != Point(bx, by):
+				break
+		return path, expansions
@@ -0,0 +1,110 @@
+import heapq
+
+class SpatialIndex:
+	#Buckets entities into square cells of 2**shift tiles so that area queries only look at the buckets they overlap.
+	#Each bucket maps a tile index (y*width+x) to the entity on that tile. Distances are Manhattan, the same as Point.distance.
+
+	def __init__(self, width, height, shift):
+		self.width = width
+		self.height = height
+		self.shift = shift
+		self.buckets = {}
+
+	def _key(self, x, y):
+		return (x >> self.shift, y >> self.shift)
+
+	def add(self, x, y, ent):
+		key = self._key(x, y)
+		bucket = self.buckets.get(key)
+		if bucket is None:
+			bucket = self.buckets[key] = {}
+		bucket[y * self.width + x] = ent
+
+	def remove(self, x, y):
+		key = self._key(x, y)
+		bucket = self.buckets.get(key)
+		if bucket is not None:
+			bucket.pop(y * self.width + x, None)
+			if not bucket:
+				del self.buckets[key]
+
+	def clear(self):
+		self.buckets.clear()
+
+	def __len__(self):
+		return sum(len(bucket) for bucket in self.buckets.values())
+
+	def _in_buckets(self, x1, y1, x2, y2):
+		#Yields (index, entity) for every entity in the buckets overlapping the rectangle
+		shift = self.shift
+		buckets = self.buckets
+		for by in range(y1 >> shift, (y2 >> shift) + 1):
+			for bx in range(x1 >> shift, (x2 >> shift) + 1):
+				if (bucket := buckets.get((bx, by))):
+					yield from bucket.items()
+
+	def in_rect(self, x1, y1, x2, y2):
+		#Entities with x1 <= x <= x2 and y1 <= y <= y2, in row-major order
+		width = self.width
+		found = []
+		for index, ent in self._in_buckets(x1, y1, x2, y2):
+			y, x = divmod(index, width)
+			if x1 <= x <= x2 and y1 <= y <= y2:
+				found.append((index, ent))
+		found.sort(key=lambda pair: pair[0])
+		return [ent for _, ent in found]
+
+	def in_radius(self, x, y, radius):
+		#Entities within a Manhattan distance of radius, in row-major order
+		width = self.width
+		found = []
+		for index, ent in self._in_buckets(x - radius, y - radius, x + radius, y + radius):
+			ey, ex = divmod(index, width)
+			if abs(ex - x) + abs(ey - y) <= radius:
+				found.append((index, ent))
+		found.sort(key=lambda pair: pair[0])
+		return [ent for _, ent in found]
+
+	def _ring(self, bx, by, ring):
+		#Bucket keys at a Chebyshev distance of exactly ring from (bx, by)
+		if ring == 0:
+			yield (bx, by)
+			return
+		for cx in range(bx - ring, bx + ring + 1):
+			yield (cx, by - ring)
+			yield (cx, by + ring)
+		for cy in range(by - ring + 1, by + ring):
+			yield (bx - ring, cy)
+			yield (bx + ring, cy)
+
+	def nearest(self, x, y, k, pred=None):
+		#Up to k entities closest to (x, y), nearest first, optionally only those for which pred(entity) is true.
+		#Searches outward one ring of buckets at a time, stopping once nothing in the next ring could be closer.
+		shift = self.shift
+		size = 1 << shift
+		width = self.width
+		buckets = self.buckets
+		bx = x >> shift
+		by = y >> shift
+		max_ring = max(self.width, self.height) // size + 1
+		total = len(self)
+		seen = 0
+		heap = []
+		for ring in range(max_ring + 1):
+			for key in self._ring(bx, by, ring):
+				bucket = buckets.get(key)
+				if not bucket:
+					continue
+				for index, ent in bucket.items():
+					seen += 1
+					if pred and not pred(ent):
+						continue
+					ey, ex = divmod(index, width)
+					heapq.heappush(heap, (abs(ex - x) + abs(ey - y), index, ent))
+			if seen >= total:
+				break
+			if len(heap) >= k:
+				#Every tile in the next ring is more than ring*size tiles away along one axis
+				if heapq.nsmallest(k, heap)[-1][0] <= ring * size:
+					break
+		return [item[2] for item in heapq.nsmallest(k, heap)]
@@ -20,19 +20,22 @@ def gen_stats():
 			stats[ind2] += 1
 		if one_in(50):
 			return stats
-	
+		if sum(5 <= s <= 15 for s in stats) < 2:
+			#No two stats can pass the checks above any more, so this would loop forever; start over
+			stats = [rng(10, 11) for _ in range(6)]
+
 def rng_float(a, b):
 	if a > b:
 		a, b = b, a
 	return random.uniform(a, b)
 	
-def triangular_roll(a, b):
+def triangular_roll(a, b, rand=random):
 	#Returns a rand integer between a and b inclusive, biased towards the average result
 	range = b - a
 	r1 = range//2
 	r2 = (range+1)//2
 	
-	return a + rng(0, r1) + rng(0, r2)
+	return a + rand.randint(0, r1) + rand.randint(0, r2)
 
 def gauss_roll(mod):
 	return random.gauss(10 + mod, 5)
@@ -47,11 +50,16 @@ def gauss_roll_prob(mod, DC):
 def clamp(val, lo, hi):
 	return max(lo, min(val, hi))
 	
-def one_in(x):
-	return x <= 1 or rng(1, x) == 1
+def one_in(x, rand=random):
+	return x <= 1 or rand.randint(1, x) == 1
+	
+def x_in_y(x, y, rand=random):
+	return rand.uniform(0.0, y) < x
 	
-def x_in_y(x, y):
-	return random.uniform(0.0, y) < x
+def derive_rng(seed, *keys):
+	#An independent random.Random for the stream named by keys, e.g. derive_rng(seed, "level", 3).
+	#String seeds are hashed with SHA-512, so the same seed and keys always give the same stream.
+	return random.Random(":".join(map(str, (seed,) + keys)))
 
 def div_rand(x, y):
 	"Computes x/y then randomly rounds the result up or down depending on the remainder"
@@ -69,9 +77,9 @@ def mult_rand_frac(val, x, y):
 def stat_mod(stat):
 	return (stat - 10) / 2 
 
-def random_weighted(entries):
+def random_weighted(entries, rand=random):
 	values, weights = list(zip(*entries))
-	return random.choices(values, weights=weights)[0]
+	return rand.choices(values, weights=weights)[0]
 	
 def dice(num, sides):
 	if sides == 1:
@@ -133,12 +141,12 @@ class WeightedList:
 		self.weights.clear()
 		self.cumulative_weights = None 
 		
-	def pick(self):
+	def pick(self, rand=random):
 		if len(self.choices) == 0:
 			raise IndexError("cannot pick from an empty weighted list")
 		if not self.cumulative_weights:
 			self.cumulative_weights = list(accumulate(self.weights))
-		return random.choices(self.choices, cum_weights=self.cumulative_weights)[0]
+		return rand.choices(self.choices, cum_weights=self.cumulative_weights)[0]
 
 	
 class Dice: